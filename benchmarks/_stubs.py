@@ -0,0 +1,246 @@
+"""
+Local stand-ins for the Plex endpoints used by the benchmark scripts.
+
+Nothing here talks to Plex. The servers bind to 127.0.0.1 on a random port.
+"""
+import os
+import ssl
+import json
+import threading
+import tempfile
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SOAP_NS = 'http://www.plexus-online.com/DataSource'
+
+WSDL_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:s="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="{ns}"
+    xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    targetNamespace="{ns}">
+  <wsdl:types>
+    <s:schema elementFormDefault="qualified" targetNamespace="{ns}">
+      <s:element name="ExecuteDataSourcePost">
+        <s:complexType>
+          <s:sequence>
+            <s:element minOccurs="1" maxOccurs="1" name="dataSourceKey" type="s:int"/>
+            <s:element minOccurs="0" maxOccurs="1" name="parameterNames" type="s:string"/>
+            <s:element minOccurs="0" maxOccurs="1" name="parameterValues" type="s:string"/>
+            <s:element minOccurs="0" maxOccurs="1" name="delimeter" type="s:string"/>
+          </s:sequence>
+        </s:complexType>
+      </s:element>
+      <s:element name="ExecuteDataSourcePostResponse">
+        <s:complexType>
+          <s:sequence>
+            <s:element minOccurs="0" maxOccurs="1" name="ExecuteDataSourcePostResult" type="tns:DataSourceResult"/>
+          </s:sequence>
+        </s:complexType>
+      </s:element>
+      <s:complexType name="DataSourceResult">
+        <s:sequence>
+          <s:element minOccurs="1" maxOccurs="1" name="DataSourceKey" type="s:int"/>
+          <s:element minOccurs="0" maxOccurs="1" name="DataSourceName" type="s:string"/>
+          <s:element minOccurs="1" maxOccurs="1" name="Error" type="s:boolean"/>
+          <s:element minOccurs="1" maxOccurs="1" name="ErrorNo" type="s:int"/>
+          <s:element minOccurs="0" maxOccurs="1" name="InstanceNo" type="s:string"/>
+          <s:element minOccurs="0" maxOccurs="1" name="Message" type="s:string"/>
+          <s:element minOccurs="1" maxOccurs="1" name="StatusNo" type="s:int"/>
+          <s:element minOccurs="0" maxOccurs="1" name="ResultSets" type="tns:ArrayOfResultSet"/>
+        </s:sequence>
+      </s:complexType>
+      <s:complexType name="ArrayOfResultSet">
+        <s:sequence>
+          <s:element minOccurs="0" maxOccurs="unbounded" name="ResultSet" type="tns:ResultSet"/>
+        </s:sequence>
+      </s:complexType>
+      <s:complexType name="ResultSet">
+        <s:sequence>
+          <s:element minOccurs="1" maxOccurs="1" name="RowCount" type="s:int"/>
+          <s:element minOccurs="0" maxOccurs="1" name="Rows" type="tns:ArrayOfRow"/>
+        </s:sequence>
+      </s:complexType>
+      <s:complexType name="ArrayOfRow">
+        <s:sequence>
+          <s:element minOccurs="0" maxOccurs="unbounded" name="Row" type="tns:Row"/>
+        </s:sequence>
+      </s:complexType>
+      <s:complexType name="Row">
+        <s:sequence>
+          <s:element minOccurs="0" maxOccurs="1" name="Columns" type="tns:ArrayOfColumn"/>
+        </s:sequence>
+      </s:complexType>
+      <s:complexType name="ArrayOfColumn">
+        <s:sequence>
+          <s:element minOccurs="0" maxOccurs="unbounded" name="Column" type="tns:Column"/>
+        </s:sequence>
+      </s:complexType>
+      <s:complexType name="Column">
+        <s:sequence>
+          <s:element minOccurs="0" maxOccurs="1" name="Name" type="s:string"/>
+          <s:element minOccurs="0" maxOccurs="1" name="Value" type="s:string"/>
+        </s:sequence>
+      </s:complexType>
+    </s:schema>
+  </wsdl:types>
+  <wsdl:message name="ExecuteDataSourcePostSoapIn">
+    <wsdl:part name="parameters" element="tns:ExecuteDataSourcePost"/>
+  </wsdl:message>
+  <wsdl:message name="ExecuteDataSourcePostSoapOut">
+    <wsdl:part name="parameters" element="tns:ExecuteDataSourcePostResponse"/>
+  </wsdl:message>
+  <wsdl:portType name="ServiceSoap">
+    <wsdl:operation name="ExecuteDataSourcePost">
+      <wsdl:input message="tns:ExecuteDataSourcePostSoapIn"/>
+      <wsdl:output message="tns:ExecuteDataSourcePostSoapOut"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="ServiceSoap" type="tns:ServiceSoap">
+    <soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="ExecuteDataSourcePost">
+      <soap:operation soapAction="{ns}/ExecuteDataSourcePost" style="document"/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="Service">
+    <wsdl:port name="ServiceSoap" binding="tns:ServiceSoap">
+      <soap:address location="{address}"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+
+def soap_response(rows:int=1, columns:int=5) -> bytes:
+    """Build an ExecuteDataSourcePost SOAP envelope with the requested number of rows."""
+    column_xml = ''.join(
+        f'<Column><Name>Column_{c}</Name><Value>value_{c}</Value></Column>' for c in range(columns)
+    )
+    row_xml = f'<Row><Columns>{column_xml}</Columns></Row>' * rows
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body>'
+        f'<ExecuteDataSourcePostResponse xmlns="{SOAP_NS}">'
+        '<ExecuteDataSourcePostResult>'
+        '<DataSourceKey>57073</DataSourceKey>'
+        '<DataSourceName>Supplier_Cert_Add</DataSourceName>'
+        '<Error>false</Error>'
+        '<ErrorNo>0</ErrorNo>'
+        '<InstanceNo>1</InstanceNo>'
+        '<Message>Success</Message>'
+        '<StatusNo>0</StatusNo>'
+        f'<ResultSets><ResultSet><RowCount>{rows}</RowCount><Rows>{row_xml}</Rows></ResultSet></ResultSets>'
+        '</ExecuteDataSourcePostResult>'
+        '</ExecuteDataSourcePostResponse>'
+        '</soap:Body>'
+        '</soap:Envelope>'
+    ).encode('utf-8')
+
+
+class _SoapHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = self.server.soap_body
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_soap_server(rows:int=1, columns:int=5) -> ThreadingHTTPServer:
+    """Start a SOAP stub on a background thread. Call shutdown() on the result when done."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SoapHandler)
+    server.daemon_threads = True
+    server.soap_body = soap_response(rows, columns)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_wsdl(address:str, folder:str=None) -> str:
+    """Write a WSDL pointing at the given address and return the file path."""
+    folder = folder or tempfile.mkdtemp()
+    path = os.path.join(folder, 'Plex_SOAP_stub.wsdl')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(WSDL_TEMPLATE.format(ns=SOAP_NS, address=address))
+    return path
+
+
+def make_certificate(folder:str=None) -> tuple:
+    """Create a self-signed certificate for 127.0.0.1 with the openssl CLI. Returns (cert_file, key_file)."""
+    folder = folder or tempfile.mkdtemp()
+    cert_file = os.path.join(folder, 'stub_cert.pem')
+    key_file = os.path.join(folder, 'stub_key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', key_file, '-out', cert_file],
+                   check=True, capture_output=True)
+    return cert_file, key_file
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def _reply(self):
+        with self.server.stats_lock:
+            self.server.requests += 1
+        body = self.server.json_body(self) if callable(self.server.json_body) else self.server.json_body
+        status = 200
+        if isinstance(body, tuple):
+            status, body = body
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        self.request_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_json_server(json_body, certificate:tuple=None) -> ThreadingHTTPServer:
+    """
+    Start a JSON stub on a background thread. Call shutdown() on the result when done.
+
+    json_body is either the object returned for every request or a callable taking the handler.
+    A callable may return (status, body) to send a status other than 200.
+    Pass a (cert_file, key_file) tuple from make_certificate() to serve HTTPS.
+    The server counts accepted connections and requests in its connections/requests attributes.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _JsonHandler)
+    server.daemon_threads = True
+    server.json_body = json_body
+    server.connections = 0
+    server.requests = 0
+    server.stats_lock = threading.Lock()
+    if certificate:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.url = f"{'https' if certificate else 'http'}://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
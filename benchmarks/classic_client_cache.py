@@ -0,0 +1,68 @@
+"""
+Per-call latency of ClassicDataSource.call_data_source with and without the cached zeep client.
+
+"before" parses the WSDL for every call, which is what call_data_source used to do.
+"after" uses the client cache.
+
+    PYTHONPATH=. python benchmarks/classic_client_cache.py [calls]
+"""
+import sys
+import time
+import statistics
+
+import requests
+from requests.auth import HTTPBasicAuth
+from zeep import Client
+from zeep.transports import Transport
+
+from pmc_automation_tools import ClassicDataSource, ClassicDataSourceInput
+from pmc_automation_tools.api.classic.datasource import clear_client_cache
+from _stubs import start_soap_server, write_wsdl
+
+
+def uncached_call(ds, query):
+    session = requests.Session()
+    session.auth = ds._auth
+    client = Client(wsdl=ds._wsdl, transport=Transport(session=session))
+    return client.service.ExecuteDataSourcePost(dataSourceKey=query.__api_id__,
+                                                parameterNames=query._parameter_names,
+                                                parameterValues=query._parameter_values,
+                                                delimeter=query._delimeter)
+
+
+def time_calls(func, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    print(f'{label:<8} mean {statistics.mean(timings) * 1000:8.3f} ms'
+          f'   median {statistics.median(timings) * 1000:8.3f} ms'
+          f'   total {sum(timings):7.3f} s')
+
+
+def main(calls=200):
+    server = start_soap_server()
+    wsdl = write_wsdl(f'http://127.0.0.1:{server.server_port}/Datasource/service.asmx')
+    ds = ClassicDataSource(auth=HTTPBasicAuth('user', 'pass'), wsdl=wsdl, test_db=False)
+    query = ClassicDataSourceInput(57073)
+    query.MP1_Supp_Cert_List_Key = 1
+    query.MP1_Note = 'benchmark'
+
+    clear_client_cache()
+    before = time_calls(lambda: uncached_call(ds, query), calls)
+    after = time_calls(lambda: ds.call_data_source(query), calls)
+    server.shutdown()
+
+    print(f'{calls} calls against a local SOAP stub')
+    report('before', before)
+    report('after', after)
+    print(f'speedup  {statistics.mean(before) / statistics.mean(after):.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,52 @@
+"""
+Peak memory and time for reading a large Classic response eagerly and lazily.
+
+"eager" converts the SOAP response with serialize_object and builds every row up front.
+"lazy" parses rows from the raw XML one at a time with iter_rows.
+
+    PYTHONPATH=. python benchmarks/classic_lazy_rows.py [rows]
+"""
+import sys
+import time
+import tracemalloc
+
+from requests.auth import HTTPBasicAuth
+
+from pmc_automation_tools import ClassicDataSource, ClassicDataSourceInput
+from _stubs import start_soap_server, write_wsdl
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def eager(ds, query):
+    return sum(1 for _ in ds.call_data_source(query).iter_rows())
+
+
+def lazy(ds, query):
+    return sum(1 for _ in ds.call_data_source(query, lazy=True).iter_rows())
+
+
+def main(rows=5000):
+    server = start_soap_server(rows=rows, columns=10)
+    wsdl = write_wsdl(f'http://127.0.0.1:{server.server_port}/Datasource/service.asmx')
+    ds = ClassicDataSource(auth=HTTPBasicAuth('user', 'pass'), wsdl=wsdl, test_db=False)
+    query = ClassicDataSourceInput(57073)
+    ds.call_data_source(query)  # parse the WSDL before measuring
+
+    print(f'{rows} rows x 10 columns from a local SOAP stub')
+    for label, func in (('eager', eager), ('lazy', lazy)):
+        count, elapsed, peak = measure(lambda: func(ds, query))
+        print(f'{label:<6} rows {count:>7}   time {elapsed:7.3f} s   peak {peak / 2**20:8.1f} MiB')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
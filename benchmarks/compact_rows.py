@@ -0,0 +1,59 @@
+"""
+Memory held by a UX response stored as a list of dictionaries and as CompactRows.
+
+Measures the memory still allocated after the response is built, with the JSON body already discarded.
+
+    PYTHONPATH=. python benchmarks/compact_rows.py [rows]
+"""
+import gc
+import sys
+import json
+import time
+import tracemalloc
+
+from pmc_automation_tools.api.ux.datasource import UXDataSourceResponse
+from pmc_automation_tools.common.utils import json_loads
+
+
+def payload(rows):
+    return json.dumps({'rows': [{'Part_Key': i,
+                                 'Part_No': f'{i}-20',
+                                 'Revision': 'A',
+                                 'Name': 'Bracket, front bumper reinforcement',
+                                 'Part_Type': 'Component',
+                                 'Part_Status': 'Production',
+                                 'Building_Code': 'GH',
+                                 'Weight': i * 0.125,
+                                 'Active': bool(i % 2),
+                                 'Add_Date': '2024-01-01T00:00:00Z'} for i in range(rows)],
+                       'rowLimitExceeded': False}).encode('utf-8')
+
+
+def retained(body, compact):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = UXDataSourceResponse(149, **json_loads(body))
+    if compact:
+        response.compact()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return response, current, peak, elapsed
+
+
+def main(rows=200000):
+    body = payload(rows)
+    print(f'{rows} rows x 10 columns')
+    results = {}
+    for label, compact in (('dicts', False), ('compact', True)):
+        response, current, peak, elapsed = retained(body, compact)
+        results[label] = current
+        print(f'{label:<8} retained {current / 2**20:8.1f} MiB   peak {peak / 2**20:8.1f} MiB   build {elapsed:6.3f} s')
+        del response
+    print(f'saving   {1 - results["compact"] / results["dicts"]:.0%}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
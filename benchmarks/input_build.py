@@ -0,0 +1,52 @@
+"""
+Cost of building data source inputs with many parameters.
+
+"before" reads the query after every assignment, which is what the previous eager rebuild in __setattr__ cost.
+"after" builds the query once when it is first read.
+
+    PYTHONPATH=. python benchmarks/input_build.py [parameters]
+"""
+import sys
+import time
+
+from pmc_automation_tools import UXDataSourceInput, ClassicDataSourceInput
+
+
+def build(cls, fields, eager):
+    query = cls(149)
+    for k, v in fields.items():
+        setattr(query, k, v)
+        if eager:
+            query._update_input_parameters()
+    query.purge_empty()
+    return query.get_request_body() if cls is UXDataSourceInput else query._parameter_values
+
+
+def build_bulk(cls, fields):
+    query = cls(149)
+    query.update(**fields)
+    query.purge_empty()
+    return query.get_request_body() if cls is UXDataSourceInput else query._parameter_values
+
+
+def best_of(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main(parameters=250):
+    fields = {f'Input_{i}': (None if i % 10 == 0 else i) for i in range(parameters)}
+    print(f'{parameters} parameters, every 10th empty')
+    for cls in (UXDataSourceInput, ClassicDataSourceInput):
+        before = best_of(lambda: build(cls, fields, eager=True))
+        after = best_of(lambda: build(cls, fields, eager=False))
+        bulk = best_of(lambda: build_bulk(cls, fields))
+        print(f'{cls.__name__:<24} before {before:8.2f} ms   after {after:6.2f} ms   update() {bulk:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 250)
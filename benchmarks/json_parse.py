@@ -0,0 +1,61 @@
+"""
+JSON parse throughput for developer portal sized payloads.
+
+Compares the standard library with the installed fast backend, and the old triple decode in
+ApiDataSource.call_data_source with the single decode.
+
+    PYTHONPATH=. python benchmarks/json_parse.py [rows]
+"""
+import sys
+import json
+import time
+
+from pmc_automation_tools.common import utils
+from pmc_automation_tools.common.utils import json_loads, JSON_BACKEND
+
+
+def payload(rows):
+    return json.dumps([{'id': f'{i:08d}-0000-0000-0000-000000000000',
+                        'partNumber': f'{i}-20',
+                        'revision': 'A',
+                        'description': 'Bracket, front bumper reinforcement ' * 2,
+                        'status': 'Active',
+                        'weight': i * 0.125,
+                        'buildings': ['Grand Haven', 'Muskegon'],
+                        'active': bool(i % 2)} for i in range(rows)]).encode('utf-8')
+
+
+def throughput(func, data, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def triple_decode(data):
+    # type check, then append, like the previous response.json() calls
+    if type(json_loads(data)) is list:
+        return json_loads(data)
+    return [json_loads(data)]
+
+
+def main(rows=20000):
+    data = payload(rows)
+    size = len(data) / 1_000_000
+    print(f'{rows} rows, {size:.1f} MB payload')
+    stdlib = throughput(json.loads, data)
+    print(f'{"json":<8} {size / stdlib:8.1f} MB/s')
+    if JSON_BACKEND != 'json':
+        fast = throughput(json_loads, data)
+        print(f'{JSON_BACKEND:<8} {size / fast:8.1f} MB/s   {stdlib / fast:.1f}x')
+    print(f'triple decode ({JSON_BACKEND}) {throughput(triple_decode, data) * 1000:8.1f} ms')
+    print(f'single decode ({JSON_BACKEND}) {throughput(json_loads, data) * 1000:8.1f} ms')
+    if utils.orjson:
+        print(f'save_json indent=4 {throughput(lambda d: utils.json_dumps(d, indent=4), json.loads(data)) * 1000:8.1f} ms')
+        print(f'save_json indent=2 {throughput(lambda d: utils.json_dumps(d, indent=2), json.loads(data)) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
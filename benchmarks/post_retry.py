@@ -0,0 +1,71 @@
+"""
+Counts the POSTs sent for one UX call that times out reading the response, with the sync and async data sources.
+
+With the default idempotent_only=True neither data source may send the POST again, since Plex may already have run it.
+With idempotent_only=False both retry it policy.total times.
+
+    PYTHONPATH=. python benchmarks/post_retry.py
+"""
+import time
+import asyncio
+
+from requests.auth import HTTPBasicAuth
+
+from pmc_automation_tools import UXDataSource, UXDataSourceInput, AsyncUXDataSource, RetryPolicy
+from _stubs import start_json_server
+
+TOTAL = 3
+READ_TIMEOUT = 0.1
+
+
+def slow_body(handler):
+    time.sleep(READ_TIMEOUT * 3)
+    return {'rows': [], 'outputs': {}, 'errors': [], 'transactionNo': '1'}
+
+
+def call_sync(server, policy):
+    ux = UXDataSource(HTTPBasicAuth('user', 'pass'), retry=policy)
+    ux._base_url = server.url
+    # The stub is plain http, the adapter is only mounted for https.
+    session = ux._get_session()
+    session.mount('http://', session.get_adapter('https://'))
+    try:
+        ux.call_data_source(UXDataSourceInput(149))
+    except Exception as e:
+        return type(e).__name__
+    finally:
+        ux.close()
+    return 'ok'
+
+
+async def call_async(server, policy):
+    async with AsyncUXDataSource(HTTPBasicAuth('user', 'pass'), retry=policy) as ux:
+        ux._base_url = server.url
+        try:
+            await ux.call_data_source(UXDataSourceInput(149))
+        except Exception as e:
+            return type(e).__name__
+    return 'ok'
+
+
+def run(server, label, call, idempotent_only):
+    server.requests = 0
+    policy = RetryPolicy(total=TOTAL, backoff=0, backoff_jitter=0, read_timeout=READ_TIMEOUT, idempotent_only=idempotent_only)
+    result = call(server, policy)
+    # Let the stub finish the requests that timed out on the client.
+    time.sleep(READ_TIMEOUT * 4)
+    expected = 1 if idempotent_only else TOTAL + 1
+    print(f'{label:<6} idempotent_only={idempotent_only!s:<6} {result:<22} POSTs sent {server.requests} (expected {expected})')
+    assert server.requests == expected
+
+
+def main():
+    server = start_json_server(slow_body)
+    for idempotent_only in (True, False):
+        run(server, 'sync', call_sync, idempotent_only)
+        run(server, 'async', lambda s, p: asyncio.run(call_async(s, p)), idempotent_only)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
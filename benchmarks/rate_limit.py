@@ -0,0 +1,69 @@
+"""
+Bulk UX calls against a stub that throttles above 40 requests per second, with and without the rate limiter.
+
+Without the limiter most calls fail with 429. With it the limiter backs off and every call succeeds.
+
+    PYTHONPATH=. python benchmarks/rate_limit.py [calls] [threads]
+"""
+import sys
+import time
+import threading
+
+from requests.auth import HTTPBasicAuth
+
+from pmc_automation_tools import UXDataSource, UXDataSourceInput
+from pmc_automation_tools.api.throttle import clear_rate_limiters
+from _stubs import start_json_server
+
+WINDOW = 0.1
+PER_WINDOW = 4
+
+
+def throttling_body():
+    lock = threading.Lock()
+    state = {'window': 0, 'count': 0}
+
+    def body(handler):
+        with lock:
+            window = int(time.time() / WINDOW)
+            if window != state['window']:
+                state['window'] = window
+                state['count'] = 0
+            state['count'] += 1
+            if state['count'] > PER_WINDOW:
+                return 429, {'errors': [{'code': '429', 'message': 'Too many requests'}], 'transactionNo': '0'}
+        return {'rows': [{'Part_Key': 1}], 'outputs': {}, 'errors': [], 'transactionNo': '1'}
+    return body
+
+
+def run(server, rate_limit, calls, threads):
+    clear_rate_limiters()
+    server.requests = 0
+    ux = UXDataSource(HTTPBasicAuth('user', 'pass'), rate_limit=rate_limit, pool_maxsize=threads, coalesce=False)
+    ux._base_url = server.url
+    if rate_limit:
+        # The stub is plain http, the adapter is only mounted for https.
+        session = ux._get_session()
+        session.mount('http://', session.get_adapter('https://'))
+    queries = [UXDataSourceInput(149) for _ in range(calls)]
+    for i, query in enumerate(queries):
+        query.Part_Key = i
+    start = time.perf_counter()
+    responses = ux.call_data_source_threaded(queries, max_workers=threads)
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for r in responses if hasattr(r, 'rows'))
+    label = 'limited' if rate_limit else 'none'
+    print(f'{label:<8} {elapsed:6.2f} s   succeeded {ok:>4}/{calls}   requests sent {server.requests:>4}')
+    ux.close()
+
+
+def main(calls=300, threads=32):
+    server = start_json_server(throttling_body())
+    print(f'{calls} calls on {threads} threads, server allows {PER_WINDOW / WINDOW:.0f} requests per second')
+    run(server, None, calls, threads)
+    run(server, {'rate': 20}, calls, threads)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
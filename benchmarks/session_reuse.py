@@ -0,0 +1,64 @@
+"""
+Connection reuse of the data source sessions against a local HTTPS stub.
+
+"before" builds a new session for every call, which is what UXDataSource and ApiDataSource used to do.
+"after" uses the long-lived session owned by each data source.
+
+    PYTHONPATH=. python benchmarks/session_reuse.py [calls]
+"""
+import sys
+import time
+
+from requests.auth import HTTPBasicAuth
+
+from pmc_automation_tools import UXDataSource, UXDataSourceInput
+from _stubs import make_certificate, start_json_server
+
+UX_BODY = {'rows': [{'Part_No': '278780-20', 'Part_Key': 1}], 'outputs': {}, 'errors': [], 'transactionNo': '1'}
+
+
+def run(label, ds, calls, cert_file, threaded=False):
+    server = start_json_server(UX_BODY, certificate=(cert_file, cert_file.replace('cert', 'key')))
+    ds._base_url = server.url
+    session_factory = ds._create_session
+
+    def verified_session():
+        # The adapter brings its own ssl context, so trust the stub certificate there.
+        session = session_factory()
+        session.get_adapter('https://').poolmanager.connection_pool_kw['ssl_context'].load_verify_locations(cert_file)
+        return session
+    ds._create_session = verified_session
+    # Distinct inputs so every call is sent even when the data source coalesces identical calls.
+    queries = [UXDataSourceInput(149, Part_No=f'278780-{i}') for i in range(calls)]
+    start = time.perf_counter()
+    if threaded:
+        ds.call_data_source_threaded(queries)
+    else:
+        for query in queries:
+            ds.call_data_source(query)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    print(f'{label:<16} requests {server.requests:5}   connections {server.connections:5}'
+          f'   reused {server.requests - server.connections:5}   {elapsed:6.3f} s')
+
+
+class PerCallSessionDataSource(UXDataSource):
+    """Recreates the session on every call like the previous implementation."""
+    def _get_session(self):
+        return self._create_session()
+
+
+def main(calls=200):
+    cert_file, _ = make_certificate()
+    auth = HTTPBasicAuth('user', 'pass')
+    print(f'{calls} UX data source calls against a local HTTPS stub')
+    run('before', PerCallSessionDataSource(auth, test_db=False), calls, cert_file)
+    with UXDataSource(auth, test_db=False) as ds:
+        run('after', ds, calls, cert_file)
+    run('before threaded', PerCallSessionDataSource(auth, test_db=False), calls, cert_file, threaded=True)
+    with UXDataSource(auth, test_db=False) as ds:
+        run('after threaded', ds, calls, cert_file, threaded=True)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
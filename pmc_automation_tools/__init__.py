@@ -1,7 +1,12 @@
-from pmc_automation_tools.api.ux.datasource import UXDataSource, UXDataSourceInput
+from pmc_automation_tools.api.ux.datasource import UXDataSource, UXDataSourceInput, UXDateConverter
+from pmc_automation_tools.api.ux.async_datasource import AsyncUXDataSource
 from pmc_automation_tools.api.classic.datasource import ClassicDataSource, ClassicDataSourceInput
 from pmc_automation_tools.api.datasource import ApiDataSource, ApiDataSourceInput
-from pmc_automation_tools.common.utils import debug_logger, create_batch_folder, setup_logger, read_updated, save_updated, chunk_list, plex_date_formatter
+from pmc_automation_tools.api.cache import ResponseCache
+from pmc_automation_tools.api.throttle import RateLimiter
+from pmc_automation_tools.api.retry import RetryPolicy
+from pmc_automation_tools.api.metrics import PrometheusTextFileSink, LogSink
+from pmc_automation_tools.common.utils import debug_logger, create_batch_folder, setup_logger, read_updated, save_updated, chunk_list, plex_date_formatter, stream_csv, stream_json
 from pmc_automation_tools.driver.ux.driver import UXDriver
 from pmc_automation_tools.driver.classic.driver import ClassicDriver
 from pmc_automation_tools.driver.generic import GenericDriver
@@ -16,10 +21,17 @@ __version__ = "0.6.8"
 __all__ = [
     "UXDataSource",
     "UXDataSourceInput",
+    "UXDateConverter",
+    "AsyncUXDataSource",
     "ClassicDataSource",
     "ClassicDataSourceInput",
     "ApiDataSource",
     "ApiDataSourceInput",
+    "ResponseCache",
+    "RateLimiter",
+    "RetryPolicy",
+    "PrometheusTextFileSink",
+    "LogSink",
     "debug_logger",
     "create_batch_folder",
     "setup_logger",
@@ -33,5 +45,7 @@ __all__ = [
     "EXISTS",
     "GenericDriver",
     "chunk_list",
-    "plex_date_formatter"
+    "plex_date_formatter",
+    "stream_csv",
+    "stream_json"
 ]
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""
+Response cache for read-only data source calls.
+
+Responses are stored pickled, so every hit returns a new copy and callers can't change the cached value.
+"""
+import os
+import re
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Literal, Dict, Union, Any
+
+# Name segments of data sources that change data. EX: Supplier_Cert_Add, Part_Operation_Update
+WRITE_NAME_PATTERN = re.compile(r'(^|_)(add|update|delete|insert|upsert|save|set|remove|create|void)(_|$)', re.IGNORECASE)
+READ_METHODS = {'GET', 'HEAD'}
+
+
+class MemoryCacheBackend:
+    """
+    Least recently used in-memory store. Oldest entries are dropped once max_entries is reached.
+    """
+    def __init__(self, max_entries:int=1024):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+
+    def get(self, key:str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+
+    def set(self, key:str, value:bytes, expires:float, data_source:str):
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def clear(self, data_source:str=None):
+        with self._lock:
+            if data_source is None:
+                self._entries.clear()
+                return
+            # Keys start with the data source id so one data source can be cleared without a second index.
+            prefix = f'{data_source}:'
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCacheBackend:
+    """
+    On-disk store that keeps responses between runs. Expired entries are removed when they are read or on clear_expired().
+    """
+    def __init__(self, path:str):
+        self._path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                     '(key TEXT PRIMARY KEY, data_source TEXT, expires REAL, value BLOB)')
+        self.evictions = 0
+
+
+    def get(self, key:str):
+        with self._lock:
+            row = self._connection.execute('SELECT expires, value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] <= time.time():
+                with self._connection:
+                    self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            return row[1]
+
+
+    def set(self, key:str, value:bytes, expires:float, data_source:str):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, data_source, expires, value) VALUES (?, ?, ?, ?)',
+                                     (key, data_source, expires, value))
+
+
+    def clear(self, data_source:str=None):
+        with self._lock, self._connection:
+            if data_source is None:
+                self._connection.execute('DELETE FROM responses')
+            else:
+                self._connection.execute('DELETE FROM responses WHERE data_source = ?', (data_source,))
+
+
+    def clear_expired(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, backend:Literal['memory', 'sqlite']='memory',
+                 path:str='resources/response_cache.sqlite',
+                 ttls:Dict[Union[int, str], float]=None,
+                 default_ttl:float=0,
+                 max_entries:int=1024,
+                 bypass:set=None):
+        """
+        Opt-in cache for data source responses. Pass to a data source with the cache parameter.
+
+        Only read-only calls are cached. The following calls always go to Plex:
+
+        - UX data sources that aren't listed in ttls. UX responses don't include the data source name, so add/update data sources can't be detected.
+        - Classic data sources whose name contains Add, Update, Delete, Insert, Upsert, Save, Set, Remove, Create, or Void.
+        - ApiDataSource calls that aren't GET requests.
+        - Data source ids or URLs in bypass.
+
+        Parameters:
+
+        - backend: 'memory' for an LRU cache that lasts for the run, or 'sqlite' to keep responses between runs.
+        - path: sqlite database file. Only used with the sqlite backend.
+        - ttls: data source id (or API URL):seconds to keep responses. EX: {149: 3600, 287: 600}
+        - default_ttl: seconds to keep Classic and API responses that aren't in ttls. 0 only caches the data sources in ttls.
+        - max_entries: number of responses kept by the memory backend.
+        - bypass: data source ids or URLs that are never cached.
+        """
+        if backend == 'memory':
+            self._backend = MemoryCacheBackend(max_entries)
+        elif backend == 'sqlite':
+            self._backend = SqliteCacheBackend(path)
+        else:
+            raise ValueError(f"Unknown cache backend '{backend}'. Use 'memory' or 'sqlite'.")
+        # Lookups and stores read or write the disk, so async callers run them in an executor.
+        self.blocking = backend == 'sqlite'
+        self._ttls = {str(k): v for k, v in (ttls or {}).items()}
+        self._default_ttl = default_ttl
+        self._bypass = {str(b) for b in (bypass or ())}
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+
+
+    def __repr__(self):
+        return f"ResponseCache(backend={type(self._backend).__name__}, entries={len(self._backend)}, stats={self.stats()})"
+
+
+    def _count(self, name:str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+
+    def _miss_to_bypass(self):
+        with self._stats_lock:
+            self._stats['misses'] -= 1
+            self._stats['bypassed'] += 1
+
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss statistics.
+
+        - hits: calls answered from the cache
+        - misses: cacheable calls that weren't in the cache
+        - bypassed: calls that can't be cached, such as add/update data sources
+        - evictions: responses dropped by the memory backend to stay under max_entries
+        - entries: responses currently stored
+        - hit_rate: hits / (hits + misses)
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['evictions'] = self._backend.evictions
+        stats['entries'] = len(self._backend)
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = dict.fromkeys(self._stats, 0)
+        self._backend.evictions = 0
+
+
+    def clear(self, data_source:Union[int, str]=None):
+        """
+        Remove cached responses.
+
+        Parameters:
+
+        - data_source: only remove responses for this data source id or URL. Removes everything if not provided.
+        """
+        self._backend.clear(None if data_source is None else str(data_source))
+
+
+    def ttl(self, data_source_type:str, data_source:Union[int, str]) -> float:
+        """
+        Return the seconds to keep responses for a data source. 0 means the data source isn't cached.
+        """
+        data_source = str(data_source)
+        if data_source in self._bypass:
+            return 0
+        if data_source in self._ttls:
+            return self._ttls[data_source]
+        if data_source_type == 'ux':
+            return 0
+        return self._default_ttl
+
+
+    @staticmethod
+    def is_write(response) -> bool:
+        """
+        Check the response for a data source that changes data. Only Classic responses include the data source name.
+        """
+        name = getattr(response, 'DataSourceName', None)
+        return bool(name) and WRITE_NAME_PATTERN.search(name) is not None
+
+
+    def get(self, key:str):
+        """Return the cached response for the key, or None."""
+        value = self._backend.get(key)
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+
+    def set(self, key:str, response, ttl:float, data_source:Union[int, str]):
+        """Store the response for ttl seconds."""
+        value = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        self._backend.set(key, value, time.time() + ttl, str(data_source))
+
+
+    def lookup(self, key:str):
+        """Return the cached response and count a hit, or count a miss and return None."""
+        response = self.get(key)
+        self._count('hits' if response is not None else 'misses')
+        return response
+
+
+    def store(self, key:str, response, ttl:float, data_source:Union[int, str]):
+        """
+        Store a response fetched after a miss unless it came from a data source that changes data.
+
+        The miss counted by lookup() is counted as bypassed instead for data sources that change data.
+        """
+        if self.is_write(response):
+            self._miss_to_bypass()
+            return
+        self.set(key, response, ttl, data_source)
+
+
+    def close(self):
+        if hasattr(self._backend, 'close'):
+            self._backend.close()
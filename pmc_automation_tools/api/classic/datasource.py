@@ -1,4 +1,6 @@
-from pmc_automation_tools.api.common import DataSourceInput, DataSourceResponse, DataSource
+from pmc_automation_tools.api.common import DataSourceInput, DataSourceResponse, DataSource, CustomSslContextHTTPAdapter
+from pmc_automation_tools.api.retry import RetryPolicy
+from pmc_automation_tools.api.rows import CompactRows
 from pmc_automation_tools.common.exceptions import ClassicConnectionError
 
 import requests
@@ -7,14 +9,102 @@ from requests.auth import HTTPBasicAuth
 from zeep import Client
 from zeep.transports import Transport
 from zeep.helpers import serialize_object
+from zeep.exceptions import TransportError
+from lxml import etree
 
-from typing import List
-from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import sys
+import threading
+from typing import Generator
 
 SOAP_TEST = 'https://testapi.plexonline.com/Datasource/service.asmx'
 SOAP_PROD = 'https://api.plexonline.com/Datasource/service.asmx'
+
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+
+def _client_cache_key(wsdl:str, auth:HTTPBasicAuth) -> tuple:
+    if os.path.exists(wsdl):
+        wsdl = os.path.abspath(wsdl)
+    return (wsdl, getattr(auth, 'username', None), getattr(auth, 'password', None))
+
+
+def get_client(wsdl:str, auth:HTTPBasicAuth) -> Client:
+    """
+    Return a zeep Client for the WSDL and credentials.
+
+    The WSDL is only parsed the first time a wsdl/auth combination is requested.
+    The same client is returned for every later call, including calls from other threads.
+    ClassicDataSource only uses the client's parsed WSDL and sends its calls through its own session.
+
+    Parameters:
+
+    - wsdl: path or URL to the SOAP wsdl file
+    - auth: HTTPBasicAuth object for the web service account
+
+    Returns:
+
+    - zeep Client object
+    """
+    key = _client_cache_key(wsdl, auth)
+    client = _CLIENT_CACHE.get(key)
+    if client is not None:
+        return client
+    with _CLIENT_CACHE_LOCK:
+        client = _CLIENT_CACHE.get(key)
+        if client is None:
+            session = requests.Session()
+            session.auth = auth
+            # Loads the WSDL and serves callers using the client directly. ClassicDataSource calls use the data source's session.
+            session.mount('https://', CustomSslContextHTTPAdapter(max_retries=RetryPolicy().urllib3_retry()))
+            client = Client(wsdl=wsdl, transport=Transport(session=session))
+            _CLIENT_CACHE[key] = client
+    return client
+
+
+def clear_client_cache(wsdl:str=None, auth:HTTPBasicAuth=None) -> None:
+    """
+    Remove cached zeep clients so the WSDL is parsed again on the next call.
+
+    Parameters:
+
+    - wsdl: only remove clients for this wsdl. All clients are removed if not provided.
+    - auth: only remove the client for this wsdl/auth combination.
+    """
+    with _CLIENT_CACHE_LOCK:
+        if wsdl is None:
+            keys = list(_CLIENT_CACHE.keys())
+        elif auth is None:
+            _wsdl = _client_cache_key(wsdl, None)[0]
+            keys = [k for k in _CLIENT_CACHE.keys() if k[0] == _wsdl]
+        else:
+            keys = [_client_cache_key(wsdl, auth)]
+        for key in keys:
+            client = _CLIENT_CACHE.pop(key, None)
+            if client is not None:
+                client.transport.session.close()
+
+
+def _local_name(tag:str) -> str:
+    return tag.rpartition('}')[2]
+
+
+_HEADER_TYPES = {
+    'DataSourceKey': int,
+    'ErrorNo': int,
+    'StatusNo': int,
+    'Error': lambda v: v.strip().lower() == 'true',
+}
+# Result header fields. Fields missing from the XML are None, like the zeep response.
+_HEADER_FIELDS = ('DataSourceKey', 'DataSourceName', 'Error', 'ErrorNo', 'InstanceNo', 'Message', 'StatusNo')
+
+
 class ClassicDataSourceInput(DataSourceInput):
     """Input object that stores the attributes for building the proper request format."""
+    _derived_attributes = ('_parameter_names', '_parameter_values')
+
     def __init__(self, data_source_key: int, *args, delimeter='|', **kwargs):
         self._delimeter = delimeter
         super().__init__(data_source_key, *args, type='classic', **kwargs)
@@ -37,6 +127,9 @@ class ClassicDataSourceInput(DataSourceInput):
 
 
 class ClassicDataSource(DataSource):
+    _call_errors = (ClassicConnectionError,)
+    _transport_errors = DataSource._transport_errors + (TransportError,)
+
     def __init__(self, auth: HTTPBasicAuth|str,
                  wsdl,
                  *args,
@@ -53,55 +146,157 @@ class ClassicDataSource(DataSource):
         """
         super().__init__(*args, auth=auth, test_db=test_db, pcn_config_file=pcn_config_file, type='classic', **kwargs)
         self._wsdl = wsdl
+        self._client = None
 
 
     def __repr__(self):
         return f"ClassicDataSource(auth={self.__auth_key__}, wsdl={self._wsdl}, test_db={self._test_db}, pcn_config_file={self._pcn_config_file})"
 
 
-    def call_data_source(self, query:ClassicDataSourceInput) -> 'ClassicDataSourceResponse':
+    def invalidate_client(self):
+        """Drop the cached zeep client for this data source's wsdl and credentials.
+
+        The WSDL will be parsed again on the next call. Use this if the wsdl file has changed.
+        """
+        clear_client_cache(self._wsdl, self._auth)
+        self._client = None
+
+
+    def _create_session(self) -> requests.Session:
+        session = super()._create_session()
+        session.auth = self._auth
+        return session
+
+
+    def _get_client(self) -> Client:
+        """
+        Return the zeep client for this data source.
+
+        The parsed WSDL is shared with every data source using the same wsdl and credentials.
+        Requests go through this data source's session, so its pool options, retry policy, and rate limiter only apply to its own calls.
+        """
+        session = self._get_session()
+        client = self._client
+        if client is None or client.transport.session is not session:
+            # Building a client from an already parsed WSDL document is cheap.
+            client = self._client = Client(wsdl=get_client(self._wsdl, self._auth).wsdl, transport=Transport(session=session))
+        return client
+
+
+    def call_data_source(self, query:ClassicDataSourceInput, lazy:bool=False, compact:bool=False, use_cache:bool=True, retry:RetryPolicy=None) -> 'ClassicDataSourceResponse':
         """Triggers the data source request.
 
         Args:
             query (ClassicDataSourceInput): object containing the input details
+            lazy (bool, optional): Keep the raw SOAP XML and parse rows on demand instead of building them all up front.
+                Use iter_rows() to read the rows one at a time. Defaults to False.
+            compact (bool, optional): Store the rows in a CompactRows container to reduce memory for large responses. Defaults to False.
+            use_cache (bool, optional): Answer from the data source's ResponseCache when one is set. Defaults to True.
+            retry (RetryPolicy, optional): Retry, timeout, and deadline settings for this call. Defaults to the data source's policy.
 
         Returns:
             ClassicDataSourceResponse: ClassicDataSourceResponse object
         """
-        session = requests.Session()
-        session.auth = self._auth
-        client = Client(wsdl=self._wsdl, transport=Transport(session=session))
+        client = self._get_client()
         self._connection_address = client.wsdl.services['Service'].ports['ServiceSoap'].binding_options['address']
         if self._test_db and self._connection_address != SOAP_TEST:
             raise ClassicConnectionError('Test database was indicated, but WSDL address does not match expected test address.')
-        response = client.service.ExecuteDataSourcePost(dataSourceKey=query.__api_id__, parameterNames=query._parameter_names, parameterValues=query._parameter_values, delimeter=query._delimeter)
-        _response = serialize_object(response, dict)
-        return ClassicDataSourceResponse(query.__api_id__, **_response)
-
-    def call_data_source_threaded(self, query_list:List['ClassicDataSourceInput']) -> List['ClassicDataSourceResponse']:
-        def error_safe_call(query):
-            try:
-                return self.call_data_source(query)
-            except ClassicConnectionError as e:
-                return e
-        with ThreadPoolExecutor(max_workers=8) as pool:
-            response_list = list(pool.map(error_safe_call, query_list))
-        return response_list    
+
+        def fetch():
+            if lazy:
+                # zeep settings are thread local, so this doesn't affect other threads sharing the cached client.
+                with client.settings(raw_response=True):
+                    response = client.service.ExecuteDataSourcePost(dataSourceKey=query.__api_id__, parameterNames=query._parameter_names, parameterValues=query._parameter_values, delimeter=query._delimeter)
+                if response.status_code != 200:
+                    # Let zeep raise the same Fault or TransportError as a call without raw_response.
+                    binding = client.service._binding
+                    binding.process_reply(client, binding.get('ExecuteDataSourcePost'), response)
+                return ClassicDataSourceResponse.from_xml(query.__api_id__, response.content, compact=compact)
+            response = client.service.ExecuteDataSourcePost(dataSourceKey=query.__api_id__, parameterNames=query._parameter_names, parameterValues=query._parameter_values, delimeter=query._delimeter)
+            _response = serialize_object(response, dict)
+            response = ClassicDataSourceResponse(query.__api_id__, **_response)
+            return response.compact() if compact else response
+        return self._cached_call(query, fetch, self._connection_address, lazy, compact, use_cache=use_cache, retry=retry)
+
 
 class ClassicDataSourceResponse(DataSourceResponse):
     def __init__(self, data_source_key, **kwargs):
         super().__init__(data_source_key, **kwargs)
+        self._check_error()
+        self._result_set = kwargs.get('ResultSets')
+        if self._result_set:
+            self._row_count = self._result_set['ResultSet'][0]['RowCount']
+            self._result_set = self._result_set['ResultSet'][0]['Rows']['Row']
+            self._format_response()
+
+
+    @classmethod
+    def from_xml(cls, data_source_key, content:bytes, compact:bool=False) -> 'ClassicDataSourceResponse':
+        """
+        Build a response from the raw SOAP XML without parsing the rows.
+
+        Only the result header is read here. Rows are parsed by iter_rows(), or all at once the first time _transformed_data is used.
+        Header fields are read wherever they appear in the result, before or after the result sets.
+
+        Parameters:
+
+        - data_source_key: data source key that was called
+        - content: SOAP response body
+        - compact: build the rows into a CompactRows container instead of a list of dictionaries.
+        """
+        header = dict.fromkeys(_HEADER_FIELDS)
+        row_count = None
+        result_depth = None
+        depth = 0
+        for event, element in etree.iterparse(io.BytesIO(content), events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if result_depth is None and _local_name(element.tag) == 'ExecuteDataSourcePostResult':
+                    result_depth = depth
+                continue
+            name = _local_name(element.tag)
+            if result_depth is not None and depth == result_depth + 1 and name != 'ResultSets':
+                value = element.text
+                if value is not None and name in _HEADER_TYPES:
+                    value = _HEADER_TYPES[name](value)
+                header[name] = value
+            elif name == 'RowCount' and row_count is None:
+                row_count = int(element.text)
+            elif name == 'Row':
+                # Rows are parsed again by iter_rows, so they are dropped while looking for header fields.
+                element.clear()
+            elif depth == result_depth:
+                break
+            depth -= 1
+        self = cls.__new__(cls)
+        DataSourceResponse.__init__(self, data_source_key, **header)
+        self._check_error()
+        self._raw_xml = content
+        self._compact = compact
+        if row_count is not None:
+            self._row_count = row_count
+        return self
+
+
+    def __getattr__(self, name):
+        # Lazy responses build the row list the first time it is needed.
+        if name == '_transformed_data' and '_raw_xml' in self.__dict__:
+            rows = self.iter_rows()
+            self._transformed_data = CompactRows(rows) if self._compact else list(rows)
+            # The rows have been read, so the XML is no longer needed.
+            del self._raw_xml
+            return self._transformed_data
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+
+    def _check_error(self):
         if self.Error:
             raise ClassicConnectionError(self.Message,
                                          data_source_key=self.DataSourceKey,
                                          instance=self.InstanceNo,
                                          status=self.StatusNo,
                                          error_no=self.ErrorNo)
-        self._result_set = kwargs.get('ResultSets')
-        if self._result_set:
-            self._row_count = self._result_set['ResultSet'][0]['RowCount']
-            self._result_set = self._result_set['ResultSet'][0]['Rows']['Row']
-            self._format_response()
+
     
     def __repr__(self):
         return (f"UXDataSourceResponse("
@@ -113,6 +308,60 @@ class ClassicDataSourceResponse(DataSourceResponse):
                 f"Error={self.Error}, "
                 f"ErrorNo={self.ErrorNo})")
 
+
+    def compact(self):
+        """
+        Store the response rows in a CompactRows container instead of a list of dictionaries.
+
+        The serialized zeep result (ResultSets) is dropped since the rows no longer need it.
+        Lazy responses build the container straight from the XML the first time the rows are used.
+
+        Returns:
+
+        - self, for chaining
+        """
+        if '_raw_xml' in self.__dict__ and '_transformed_data' not in self.__dict__:
+            self._compact = True
+            return self
+        super().compact()
+        self.__dict__.pop('ResultSets', None)
+        self.__dict__.pop('_result_set', None)
+        return self
+
+
+    def iter_rows(self) -> Generator[dict, None, None]:
+        """
+        Yield the response rows one at a time.
+
+        Lazy responses parse each row from the SOAP XML as it is requested. Column names are interned and shared between rows.
+        """
+        if '_transformed_data' in self.__dict__ or '_raw_xml' not in self.__dict__:
+            yield from getattr(self, '_transformed_data', [])
+            return
+        names = {}
+        for _, element in etree.iterparse(io.BytesIO(self._raw_xml), tag=('{*}Row', '{*}ResultSet')):
+            if _local_name(element.tag) == 'ResultSet':
+                # Only the first result set is returned, matching the eager response.
+                break
+            row_data = {}
+            for column in element.iterfind('{*}Columns/{*}Column'):
+                name = value = None
+                for child in column:
+                    child_name = _local_name(child.tag)
+                    if child_name == 'Name':
+                        name = child.text
+                    elif child_name == 'Value':
+                        value = child.text
+                key = names.get(name)
+                if key is None:
+                    key = names[name] = sys.intern(name) if isinstance(name, str) else name
+                row_data[key] = value
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+            yield row_data
+
+
     def _format_response(self):
         self._transformed_data = []
         if hasattr(self, '_result_set'):
@@ -124,4 +373,4 @@ class ClassicDataSourceResponse(DataSourceResponse):
                     value = column['Value']
                     row_data[name] = value
                 self._transformed_data.append(row_data)
-        return self._transformed_data
\ No newline at end of file
+        return self._transformed_data
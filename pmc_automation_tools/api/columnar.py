@@ -0,0 +1,231 @@
+"""
+Column conversion for exporting data source responses to pyarrow, pandas and parquet.
+
+pyarrow and pandas are optional dependencies and are only imported when an export is requested.
+"""
+import re
+import importlib
+from datetime import datetime, timezone
+from collections.abc import Mapping
+from typing import Iterable, Dict, Any, Union
+
+from pmc_automation_tools.common.utils import json_dumps
+
+_ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?Z?$')
+_TRUE_STRINGS = {'1', 'TRUE', 'T', 'Y', 'YES'}
+
+
+def import_optional(module:str):
+    """
+    Import an optional dependency, raising an ImportError which explains how to install it.
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        package = module.split('.')[0]
+        raise ImportError(f'{package} is required for this export. Install it with "pip install {package}".') from e
+
+
+def _is_ux_datetime(value) -> bool:
+    return hasattr(value, 'datasource_date') and hasattr(value, 'datestring')
+
+
+def _to_datetime(value) -> Union[datetime, None]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if _is_ux_datetime(value):
+        value = value.datasource_date
+    value = str(value)
+    if not _ISO_DATETIME.match(value):
+        # Classic and varchar date formats. UXDatetime's converter changes them to the ISO format used by UX.
+        from pmc_automation_tools.api.ux.datasource import _DATE_CONVERTER
+        value = _DATE_CONVERTER.convert(value)
+        if not value or not _ISO_DATETIME.match(value):
+            return None
+    value = value.rstrip('Z')
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+
+
+def _to_bool(value) -> Union[bool, None]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        return value.strip().upper() in _TRUE_STRINGS
+    return bool(value)
+
+
+def _to_int(value) -> Union[int, None]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return int(value)
+
+
+def _to_float(value) -> Union[float, None]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return float(value)
+
+
+def _to_str(value) -> Union[str, None]:
+    if value is None:
+        return None
+    if _is_ux_datetime(value):
+        return value.datasource_date
+    return value if isinstance(value, str) else str(value)
+
+
+CONVERTERS = {
+    bool: _to_bool,
+    int: _to_int,
+    float: _to_float,
+    str: _to_str,
+    datetime: _to_datetime,
+}
+
+
+def _normalize_type(value_type):
+    if value_type is None:
+        return None
+    if getattr(value_type, '__name__', None) == 'UXDatetime':
+        return datetime
+    if isinstance(value_type, type) and value_type not in CONVERTERS:
+        return None
+    return value_type
+
+
+def infer_type(values:Iterable[Any]):
+    """
+    Work out the column type from its values.
+
+    Returns bool, int, float, str or datetime. Returns None for nested values which are left to pyarrow to infer.
+    bool values mixed with int or float values are counted as int, so the column stays numeric.
+    """
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add(bool)
+        elif isinstance(value, int):
+            kinds.add(int)
+        elif isinstance(value, float):
+            kinds.add(float)
+        elif isinstance(value, datetime) or _is_ux_datetime(value):
+            kinds.add(datetime)
+        elif isinstance(value, str):
+            kinds.add(datetime if _ISO_DATETIME.match(value) else str)
+        else:
+            return None
+    if bool in kinds and len(kinds) > 1:
+        # Columns mixing True/False with numbers keep the numbers. True and False become 1 and 0.
+        kinds = {int if kind is bool else kind for kind in kinds}
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds == {int, float}:
+        return float
+    return str
+
+
+def build_columns(rows:Iterable[Dict[str, Any]], schema:Dict[str, Any]=None) -> Dict[str, tuple]:
+    """
+    Convert rows into typed columns.
+
+    Parameters:
+
+    - rows: iterable of dictionaries
+    - schema: optional column:type mapping.
+              Types can be bool, int, float, str, datetime, UXDatetime, or a pyarrow DataType.
+              Columns not in the schema are inferred from their values.
+
+    Returns:
+
+    - dictionary of column name: (type, list of values)
+
+    Raises ValueError naming the column if a value can't be converted to its schema type.
+    """
+    if schema is not None and not isinstance(schema, Mapping):
+        # Data source inputs describe what is sent to Plex, not the columns that come back.
+        raise TypeError(f'schema must be a column:type mapping, not {type(schema).__name__}.')
+    schema = dict(schema or {})
+    if hasattr(rows, 'column') and hasattr(rows, 'columns'):
+        # CompactRows already stores the values by column.
+        names = rows.columns
+        get_values = rows.column
+    else:
+        rows = list(rows)
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row.keys()))
+        get_values = lambda name: [row.get(name) for row in rows]
+    columns = {}
+    for name in names:
+        values = get_values(name)
+        value_type = _normalize_type(schema.get(name)) or infer_type(values)
+        converter = CONVERTERS.get(value_type)
+        if converter is not None:
+            try:
+                values = [converter(v) for v in values]
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Column '{name}' can't be converted to {getattr(value_type, '__name__', value_type)}: {e}") from e
+        columns[name] = (value_type, values)
+    return columns
+
+
+def _arrow_type(pa, value_type):
+    return {
+        bool: pa.bool_(),
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        datetime: pa.timestamp('us', tz='UTC'),
+    }.get(value_type, value_type)
+
+
+def to_arrow(rows:Iterable[Dict[str, Any]], schema:Dict[str, Any]=None):
+    """
+    Build a pyarrow Table from rows. See build_columns for the schema format.
+    """
+    pa = import_optional('pyarrow')
+    arrays = {}
+    for name, (value_type, values) in build_columns(rows, schema).items():
+        if value_type is None:
+            try:
+                arrays[name] = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Mixed nested values are stored as JSON text.
+                arrays[name] = pa.array([None if v is None else json_dumps(v, default=str) for v in values], type=pa.string())
+        else:
+            arrays[name] = pa.array(values, type=_arrow_type(pa, value_type))
+    return pa.table(arrays)
+
+
+def to_dataframe(rows:Iterable[Dict[str, Any]], schema:Dict[str, Any]=None):
+    """
+    Build a pandas DataFrame from rows. Uses pyarrow when installed. See build_columns for the schema format.
+    """
+    pd = import_optional('pandas')
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+    if pyarrow is not None:
+        return to_arrow(rows, schema).to_pandas()
+    dtypes = {bool: 'boolean', int: 'Int64', float: 'Float64', str: 'string'}
+    data = {}
+    for name, (value_type, values) in build_columns(rows, schema).items():
+        if value_type is datetime:
+            data[name] = pd.to_datetime(values, utc=True)
+        else:
+            data[name] = pd.Series(values, dtype=dtypes.get(value_type, 'object'))
+    return pd.DataFrame(data)
+
+
+def save_parquet(rows:Iterable[Dict[str, Any]], out_file:str, schema:Dict[str, Any]=None, **kwargs) -> None:
+    """
+    Write rows to a parquet file. kwargs are passed to pyarrow.parquet.write_table.
+    """
+    pq = import_optional('pyarrow.parquet')
+    pq.write_table(to_arrow(rows, schema), out_file, **kwargs)
@@ -1,10 +1,34 @@
-import csv
-import os
-import json
+import time
+import hashlib
+import threading
+import functools
+import requests
 from requests.auth import HTTPBasicAuth
-from pmc_automation_tools.common.exceptions import PlexResponseError
-from typing import Literal, Union
+from pmc_automation_tools.common.exceptions import PlexResponseError, CircuitOpenError, DeadlineExceededError
+from pmc_automation_tools.common.utils import json_dumps, stream_csv, JSON_BACKEND
+from pmc_automation_tools.api.rows import CompactRows
+from pmc_automation_tools.api.throttle import (
+    RateLimiter,
+    THROTTLE_STATUSES,
+    get_rate_limiter,
+    parse_retry_after,
+    backoff_time
+    )
+from pmc_automation_tools.api.retry import (
+    RetryPolicy,
+    RETRY_COUNT,
+    BACKOFF,
+    BACKOFF_JITTER,
+    RETRY_STATUSES,
+    call_context,
+    current_call
+    )
+from pmc_automation_tools.api.credentials import get_credential_store
+from pmc_automation_tools.api.metrics import POOL_CLASSES, measure, get_sinks, send_timed, current_metrics, row_count
+from typing import Literal, Union, Iterable, Generator, List, Callable
 from abc import ABC, abstractmethod
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from requests.adapters import HTTPAdapter
 from urllib3 import PoolManager
 from urllib3.util.ssl_ import create_urllib3_context
@@ -29,22 +53,141 @@ Base response class
 
 """
 TYPE_VALUES = ['classic', 'ux', 'api']
-RETRY_COUNT = 10
-BACKOFF = 0.5
-RETRY_STATUSES = [500, 502, 503, 504]
+MAX_WORKERS = 8
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
+
+@functools.lru_cache(maxsize=None)
+def _legacy_ssl_context():
+    ctx = create_urllib3_context()
+    ctx.load_default_certs()
+    ctx.options |= 0x4  # ssl.OP_LEGACY_SERVER_CONNECT
+    return ctx
 
 class CustomSslContextHTTPAdapter(HTTPAdapter):
-    """"Transport adapter" that allows us to use a custom ssl context object with the requests."""
-    def init_poolmanager(self, connections, maxsize, block=False):
-        ctx = create_urllib3_context()
-        ctx.load_default_certs()
-        ctx.options |= 0x4  # ssl.OP_LEGACY_SERVER_CONNECT
-        self.poolmanager = PoolManager(ssl_context=ctx)
+    """"Transport adapter" that allows us to use a custom ssl context object with the requests.
+
+    The ssl context is built once and shared by every adapter.
+    During a data source call, the retries and timeouts come from the call's RetryPolicy instead of the adapter's defaults.
+    """
+    # Statuses retried somewhere other than urllib3.
+    _exclude_statuses = ()
+
+    @property
+    def max_retries(self):
+        call = current_call()
+        if call is None:
+            return self._max_retries
+        return call.policy.urllib3_retry(call.deadline, self._exclude_statuses)
+
+
+    @max_retries.setter
+    def max_retries(self, value):
+        self._max_retries = value
+
+
+    def send(self, request, timeout=None, **kwargs):
+        call = current_call()
+        if call is not None and timeout is None:
+            timeout = call.policy.timeout(call.deadline)
+        return send_timed(super().send, request, timeout=timeout, **kwargs)
+
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = PoolManager(num_pools=connections, maxsize=maxsize, block=block, ssl_context=_legacy_ssl_context(), **pool_kwargs)
+        # Connection classes which time DNS, connect, and TLS when the data source call is measured.
+        self.poolmanager.pool_classes_by_scheme = POOL_CLASSES
+
+
+class RateLimitedHTTPAdapter(CustomSslContextHTTPAdapter):
+    """
+    Adapter that sends every request through a RateLimiter.
+
+    429 and 503 responses are retried here instead of by urllib3 so the limiter can slow down.
+    The Retry-After header is honored, otherwise the retry waits an exponential backoff with full jitter.
+    """
+    _exclude_statuses = tuple(THROTTLE_STATUSES)
+
+    def __init__(self, limiter:RateLimiter, *args, **kwargs):
+        self._limiter = limiter
+        super().__init__(*args, **kwargs)
+
+
+    def send(self, request, **kwargs):
+        call = current_call()
+        total = RETRY_COUNT if call is None else call.policy.total
+        for attempt in range(total + 1):
+            self._limiter.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except BaseException:
+                self._limiter.release()
+                raise
+            if response.status_code not in THROTTLE_STATUSES or attempt == total or (call is not None and call.expired()):
+                self._limiter.release()
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self._limiter.release(throttled=True, retry_after=retry_after)
+            response.close()
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.add(retries=1)
+            if retry_after is None:
+                delay = backoff_time(attempt)
+                if call is not None and call.deadline is not None:
+                    delay = min(delay, max(0.0, call.deadline - time.monotonic()))
+                time.sleep(delay)
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time. Callers asking for a key that is already running wait for that call and receive its result.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+
+    def do(self, key, func):
+        """
+        Call func() unless a call for key is already running, in which case wait for it.
+
+        Exceptions raised by func are raised for every caller sharing the call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
 
 
 class DataSourceInput(ABC):
     """
     """
+    # Attributes built by _update_input_parameters.
+    # They are dropped when an input changes and rebuilt the next time they are read.
+    _derived_attributes = ('_query_string',)
+
     def __init__(self, api_id: str, type: Literal['classic', 'ux', 'api'], *args, **kwargs):
         self.__api_id__ = str(api_id)
         self.__refresh_query__ = True
@@ -52,24 +195,49 @@ class DataSourceInput(ABC):
         if not type.lower() in TYPE_VALUES:
             raise ValueError(f"{type(self).__name__} type must be one of {TYPE_VALUES}. Received '{type}'.")
         self.__datasource_type__ = type
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+        self.update(**kwargs)
         if kwargs.get('json'):
             self.__refresh_query__ = False
             self._query_string = kwargs['json']
-        else:
-            self._update_input_parameters()
 
 
     def __setattr__(self, name, value):
         self.__dict__[name] = value
         if not name.startswith('_') and self.__refresh_query__:
+            self._mark_dirty()
+
+
+    def __getattr__(self, name):
+        # Only called when the attribute is missing, which for derived attributes means an input changed since they were built.
+        # Inputs built from json= keep the body they were given, so they are never rebuilt.
+        if name in type(self)._derived_attributes and self.__dict__.get('__refresh_query__'):
             self._update_input_parameters()
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+
+    def _mark_dirty(self):
+        for name in self._derived_attributes:
+            self.__dict__.pop(name, None)
+
 
     @abstractmethod
     def _update_input_parameters(self):...
 
 
+    def update(self, **kwargs):
+        """
+        Set any number of input attributes at once.
+
+        Parameters:
+        - **kwargs: input name=value pairs
+        """
+        self.__dict__.update(kwargs)
+        if self.__refresh_query__:
+            self._mark_dirty()
+
+
     def pop_inputs(self, *args, **kwargs):
         """
         Will remove attributes from the class that are not needed.
@@ -87,7 +255,7 @@ class DataSourceInput(ABC):
             if attr.startswith('_'):
                 continue
             vars(self).pop(attr, None)
-        self._update_input_parameters()
+        self._mark_dirty()
 
 
     def purge_empty(self):
@@ -104,10 +272,23 @@ class DataSourceInput(ABC):
             self.pop_inputs(y)
 
 class DataSource(ABC):
+    # Exceptions returned in place of a response by the threaded calls instead of being raised.
+    _call_errors = ()
+    # Exceptions meaning Plex couldn't be reached or didn't answer in time. They count against the endpoint's circuit breaker.
+    _transport_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.RetryError)
+
     def __init__(self, auth: HTTPBasicAuth|str,
                        test_db: bool = True,
                        pcn_config_file: str='resources/pcn_config.json',
                        type: Literal['classic', 'ux', 'api']='ux',
+                       pool_connections: int=POOL_CONNECTIONS,
+                       pool_maxsize: int=POOL_MAXSIZE,
+                       pool_block: bool=False,
+                       cache: 'ResponseCache'=None,
+                       coalesce: bool=None,
+                       rate_limit: Union[bool, dict, RateLimiter]=None,
+                       retry: RetryPolicy=None,
+                       metrics: Union[Callable, Iterable[Callable]]=None,
                        **kwargs):
         """
         Parameters:
@@ -122,13 +303,114 @@ class DataSource(ABC):
         
         - pcn_config_file: str, optional
             - Path to JSON file containing username/password credentials for HTTPBasicAuth connections.
+
+        - pool_connections: int, optional
+            - Number of hosts to keep connection pools for.
+
+        - pool_maxsize: int, optional
+            - Number of connections kept alive per host by the data source's session.
+            - Should be at least the number of threads calling the data source at the same time.
+
+        - pool_block: bool, optional
+            - Wait for a free connection instead of opening a throwaway one when the pool is exhausted.
+
+        - cache: ResponseCache, optional
+            - Cache for read-only data source responses. The same cache can be shared by several data sources.
+
+        - coalesce: bool, optional
+            - Identical calls in flight at the same time share one request and receive the same response object.
+            - None only shares ApiDataSource GET requests. UX and Classic calls can't be told apart from add/update calls,
+              so pass True to share them, and only for data sources that don't change data. False sends every call.
+
+        - rate_limit: bool | dict | RateLimiter, optional
+            - Send requests through a client-side rate limiter which adapts to Plex throttling.
+            - True uses the default limits. A dictionary of RateLimiter parameters sets the starting limits.
+            - The limiter is shared with every data source using the same credentials in this process.
+            - Pass a RateLimiter object to manage the sharing yourself.
+
+        - retry: RetryPolicy, optional
+            - Retries, connect/read timeouts, total deadline, and circuit breaker settings for every call.
+            - Can be overridden for a single call with the retry parameter of call_data_source.
+
+        - metrics: callable | list of callables, optional
+            - Sinks called with a CallMetrics object after every call sent to Plex.
+            - CallMetrics has the DNS, connect, TLS, server, transfer, and parse timings, payload bytes, retries, and rows.
+            - See PrometheusTextFileSink and LogSink in api.metrics.
         """
         
         self._test_db = test_db
         self._pcn_config_file = pcn_config_file
         self.__datasource_type__ = type
         self.__auth_key__ = auth
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._cache = cache
+        self._coalesce = coalesce
+        self._single_flight = SingleFlight()
         self._auth = self.set_auth(kwargs.get('pcn', auth))
+        self._rate_limiter = self._get_rate_limiter(rate_limit)
+        self._retry = retry or RetryPolicy()
+        self._metrics = get_sinks(metrics)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _get_rate_limiter(self, rate_limit) -> Union[RateLimiter, None]:
+        if not rate_limit:
+            return None
+        if isinstance(rate_limit, RateLimiter):
+            return rate_limit
+        identity = getattr(self._auth, 'username', self._auth)
+        return get_rate_limiter(identity, **(rate_limit if isinstance(rate_limit, dict) else {}))
+
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        pool_kwargs = {'pool_connections': self._pool_connections,
+                       'pool_maxsize': self._pool_maxsize,
+                       'pool_block': self._pool_block}
+        if self._rate_limiter is None:
+            adapter = CustomSslContextHTTPAdapter(max_retries=self._retry.urllib3_retry(), **pool_kwargs)
+        else:
+            # Throttling responses are retried by the adapter so the limiter sees them.
+            retry = self._retry.urllib3_retry(exclude_statuses=THROTTLE_STATUSES)
+            adapter = RateLimitedHTTPAdapter(self._rate_limiter, max_retries=retry, **pool_kwargs)
+        session.mount('https://', adapter)
+        return session
+
+
+    def _get_session(self) -> requests.Session:
+        """
+        Return the session owned by this data source, creating it on first use.
+
+        The session keeps connections alive between calls and is shared by the worker threads in call_data_source_threaded.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+
+    def close(self):
+        """
+        Close the data source's session and any open connections.
+
+        A new session will be created if the data source is called again.
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
 
     def _check_api_key(self, input_str: str) -> bool:
@@ -146,6 +428,7 @@ class DataSource(ABC):
             - PCN Reference key for getting the username/password in a json config file.
         
         If not sending an API Key or HTTPBasicAuth object, Expects a JSON file which holds the webservice credentials.
+        The file is loaded once per process and only read again after it changes.
             .. code-block:: json
                 {
                     "PCN_REF":{
@@ -160,26 +443,197 @@ class DataSource(ABC):
         """
         if isinstance(key, HTTPBasicAuth) or self._check_api_key(key):# or key is None:
             return key
-        if not os.path.exists(self._pcn_config_file):
+        store = get_credential_store(self._pcn_config_file)
+        if not store.exists():
             print(f'PCN config file "{self._pcn_config_file}" missing. Create one or enter your credentials now.')
-            username = input('Webservice username:')
-            password = input('Webservice password:')
         else:
-            with open(self._pcn_config_file, 'r', encoding='utf-8') as c:
-                self.launch_pcn_dict = json.load(c)
-            if key not in self.launch_pcn_dict.keys():
-                print(f'Provided auth key {key} not in config file. Update the file or enter your credentials now.')
-                username = input('Webservice username:')
-                password = input('Webservice password:')
-            else:
-                username = self.launch_pcn_dict[key]['api_user']
-                password = self.launch_pcn_dict[key]['api_pass']
+            self.launch_pcn_dict = store.credentials
+            auth = store.get(key)
+            if auth is not None:
+                return auth
+            print(f'Provided auth key {key} not in config file. Update the file or enter your credentials now.')
+        username = input('Webservice username:')
+        password = input('Webservice password:')
         return HTTPBasicAuth(username, password)
     
     @abstractmethod
     def call_data_source(self):...
 
 
+    def _request_key(self, query:DataSourceInput, *extra) -> str:
+        """
+        Build a key identifying the call from the data source, account, database, and normalized inputs.
+
+        extra values are added to the key. EX: the PCN and request method for ApiDataSource.
+        The account identity and inputs are hashed, so passwords and API keys aren't kept in the key.
+        """
+        inputs = sorted((k, v) for k, v in vars(query).items() if not k.startswith('_'))
+        identity = getattr(self._auth, 'username', self._auth)
+        normalized = json_dumps([self.__datasource_type__, identity, self._test_db, inputs, extra], default=str)
+        return f'{query.__api_id__}:{hashlib.sha256(normalized.encode("utf-8")).hexdigest()}'
+
+
+    def _can_coalesce(self, query:DataSourceInput) -> bool:
+        """
+        Return True if identical calls for the query can share one request.
+
+        UX and Classic inputs don't show whether the data source changes data, so they are only shared when coalesce=True.
+        """
+        return bool(self._coalesce)
+
+
+    def _cache_ttl(self, query:DataSourceInput, use_cache:bool=True) -> float:
+        """
+        Return the seconds to cache the response for, or 0 if the call can't be cached.
+
+        Calls which can't be cached are counted as bypassed.
+        """
+        cache = self._cache
+        if cache is None:
+            return 0
+        ttl = cache.ttl(self.__datasource_type__, query.__api_id__) if use_cache else 0
+        if not ttl:
+            cache._count('bypassed')
+        return ttl
+
+
+    def _endpoint(self, query:DataSourceInput) -> str:
+        return f"{self.__datasource_type__}:{'test' if self._test_db else 'prod'}:{query.__api_id__}"
+
+
+    def _guarded_call(self, query:DataSourceInput, fetch, retry:RetryPolicy=None):
+        """
+        Call fetch() under the retry policy.
+
+        Raises CircuitOpenError without calling Plex if the endpoint has failed too many times in a row.
+        Raises DeadlineExceededError if the policy's deadline passed before Plex answered.
+        """
+        policy = retry or self._retry
+        endpoint = self._endpoint(query)
+        breaker = policy.circuit_breaker(endpoint)
+        trial = breaker.before_call() if breaker is not None else False
+        try:
+            with measure(self._metrics, self.__datasource_type__, query.__api_id__, endpoint) as metrics, call_context(policy) as call:
+                try:
+                    response = fetch()
+                    if metrics is not None:
+                        metrics.rows = row_count(response)
+                except self._transport_errors as e:
+                    if breaker is not None:
+                        breaker.record_failure()
+                    if call.expired():
+                        raise DeadlineExceededError(f'{endpoint} did not finish within {policy.deadline} seconds.',
+                                                    endpoint=endpoint, deadline=policy.deadline) from e
+                    raise
+                except Exception:
+                    # Plex answered, even if it was with an error, so the endpoint is up.
+                    if breaker is not None:
+                        breaker.record_success()
+                    raise
+            if breaker is not None:
+                breaker.record_success()
+        finally:
+            if breaker is not None:
+                breaker.end_call(trial)
+        return response
+
+
+    def _cached_call(self, query:DataSourceInput, fetch, *extra, use_cache:bool=True, coalesce:bool=True, retry:RetryPolicy=None):
+        """
+        Return the cached response for the query, or call fetch() and cache the response.
+
+        Identical calls made while fetch() is running wait for it and receive the same response instead of calling Plex again.
+        fetch() runs under the retry policy, see _guarded_call.
+
+        extra values are added to the request key. EX: the PCN and request method for ApiDataSource.
+        """
+        _fetch = fetch
+        fetch = lambda: self._guarded_call(query, _fetch, retry)
+        coalesce = coalesce and self._can_coalesce(query)
+        ttl = self._cache_ttl(query, use_cache)
+        if not ttl and not coalesce:
+            return fetch()
+        key = self._request_key(query, *extra)
+
+        def load():
+            if not ttl:
+                return fetch()
+            response = self._cache.lookup(key)
+            if response is not None:
+                return response
+            response = fetch()
+            if isinstance(response, DataSourceResponse):
+                self._cache.store(key, response, ttl, query.__api_id__)
+            return response
+        if coalesce:
+            return self._single_flight.do(key, load)
+        return load()
+
+
+    def _error_safe_call(self, query, **kwargs):
+        try:
+            return self.call_data_source(query=query, **kwargs)
+        except self._call_errors + self._transport_errors + (CircuitOpenError, DeadlineExceededError) as e:
+            return e
+
+
+    def call_data_source_threaded(self, query_list:List[DataSourceInput], max_workers:int=MAX_WORKERS, **kwargs) -> list:
+        """
+        Call the data source for each input using a thread pool.
+
+        Parameters:
+
+        - query_list: list of DataSourceInput objects
+        - max_workers: number of threads making calls at the same time
+        - kwargs: passed to call_data_source for every input. EX: pcn for ApiDataSource.
+
+        Returns:
+
+        - list of responses in the same order as the inputs.
+          Data source errors and connection or timeout errors are returned in place of the response for failed calls.
+          Identical inputs running at the same time share one request when the data source coalesces them, see coalesce.
+        """
+        call = functools.partial(self._error_safe_call, **kwargs)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(call, query_list))
+
+
+    def call_data_source_as_completed(self, query_list:Iterable[DataSourceInput], max_workers:int=MAX_WORKERS, **kwargs) -> Generator[tuple, None, None]:
+        """
+        Call the data source for each input using a thread pool and yield the results as each call finishes.
+
+        Inputs are read from query_list as workers free up, so a generator of inputs is never fully loaded into memory.
+
+        Parameters:
+
+        - query_list: iterable of DataSourceInput objects
+        - max_workers: number of threads making calls at the same time
+        - kwargs: passed to call_data_source for every input. EX: pcn for ApiDataSource.
+
+        Yields:
+
+        - (input, response) tuples in completion order.
+          Data source errors and connection or timeout errors are yielded in place of the response for failed calls.
+        """
+        call = functools.partial(self._error_safe_call, **kwargs)
+        queries = iter(query_list)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            try:
+                for query in islice(queries, max_workers * 2):
+                    pending[pool.submit(call, query)] = query
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        query = pending.pop(future)
+                        for next_query in islice(queries, 1):
+                            pending[pool.submit(call, next_query)] = next_query
+                        yield query, future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
 
 class DataSourceResponse(ABC):
     def __init__(self, api_id, **kwargs):
@@ -195,26 +649,227 @@ class DataSourceResponse(ABC):
     @abstractmethod
     def _format_response(self):...
 
+
+    def iter_rows(self):
+        """
+        Yield the response rows one at a time.
+        """
+        yield from getattr(self, '_transformed_data', [])
+
     def save_csv(self, out_file):
         """
         Save the response object to a provided CSV file.
+
+        The header includes every key found in any row.
         """
         if not getattr(self, '_transformed_data', []):
             raise PlexResponseError(f'{type(self).__name__} has no transformed data to save.')
-        with open(out_file, 'w+', encoding='utf-8') as f:
-            c = csv.DictWriter(f, fieldnames=self._transformed_data[0].keys(), lineterminator='\n')
-            c.writeheader()
-            c.writerows(self._transformed_data)
+        stream_csv(self._transformed_data, out_file)
     
     
-    def save_json(self, out_file):
+    def save_json(self, out_file, indent:int=4):
         """
         Save the response object to a provided JSON file.
+
+        Parameters:
+
+        - out_file: file location to save
+        - indent: number of spaces to indent by. Use 2 or None to write with orjson when it is installed.
         """
         if not getattr(self, '_transformed_data', []):
             raise PlexResponseError(f'{type(self).__name__} has no transformed data to save.')
         with open(out_file, 'w+', encoding='utf-8') as f:
-            f.write(json.dumps(self._transformed_data, indent=4))
+            if isinstance(self._transformed_data, CompactRows):
+                # Write one row at a time so the row dictionaries are never all in memory together.
+                prefix = ' ' * indent if indent is not None else ''
+                separator = ',\n' if indent is not None else ', ' if JSON_BACKEND == 'json' else ','
+                f.write('[\n' if indent is not None else '[')
+                for i, row in enumerate(self._transformed_data.iter_dicts()):
+                    if i:
+                        f.write(separator)
+                    encoded = json_dumps(row, indent=indent)
+                    f.write(prefix + encoded.replace('\n', '\n' + prefix) if prefix else encoded)
+                f.write('\n]' if indent is not None else ']')
+            else:
+                f.write(json_dumps(self._transformed_data, indent=indent))
+
+
+    def compact(self):
+        """
+        Store the response rows in a CompactRows container instead of a list of dictionaries.
+
+        Column names are stored once and each column's values are kept in a single list.
+        Rows are still returned as dictionary-like objects, and get_response_attribute, build_index, save_csv, and save_json work the same.
+
+        Returns:
+
+        - self, for chaining
+        """
+        data = getattr(self, '_transformed_data', None)
+        if data is None or isinstance(data, CompactRows):
+            return self
+        rows = CompactRows(data)
+        # Replace every reference to the old list, such as UXDataSourceResponse.rows, so it can be freed.
+        for key, value in list(vars(self).items()):
+            if value is data:
+                setattr(self, key, rows)
+        return self
+
+
+    def to_arrow(self, schema:dict=None):
+        """
+        Convert the response rows to a pyarrow Table. Requires pyarrow.
+
+        Parameters:
+
+        - schema: optional column:type mapping.
+                  Types can be bool, int, float, str, datetime, UXDatetime, or a pyarrow DataType.
+                  Columns not in the schema are typed from their values. ISO date strings and UXDatetime values become UTC timestamps.
+        """
+        from pmc_automation_tools.api import columnar
+        return columnar.to_arrow(self._transformed_data, schema)
+
+
+    def to_dataframe(self, schema:dict=None):
+        """
+        Convert the response rows to a pandas DataFrame. Requires pandas. See to_arrow for the schema format.
+        """
+        from pmc_automation_tools.api import columnar
+        return columnar.to_dataframe(self._transformed_data, schema)
+
+
+    def save_parquet(self, out_file, schema:dict=None, **kwargs):
+        """
+        Save the response object to a provided parquet file. Requires pyarrow. See to_arrow for the schema format.
+
+        kwargs are passed to pyarrow.parquet.write_table. EX: compression='zstd'
+        """
+        if not getattr(self, '_transformed_data', []):
+            raise PlexResponseError(f'{type(self).__name__} has no transformed data to save.')
+        from pmc_automation_tools.api import columnar
+        columnar.save_parquet(self._transformed_data, out_file, schema, **kwargs)
+
+
+    def build_index(self, *columns):
+        """
+        Build hash indexes on the provided columns to speed up get_response_attribute filters.
+
+        Equality, list and "!" exclusion filters on an indexed column look up the matching rows instead of scanning the response.
+        Indexes on CompactRows are rebuilt automatically after rows or values change. Indexes on a list of rows are only rebuilt
+        automatically if the list is replaced or changes length. Call build_index again after changing list rows in place.
+
+        Parameters:
+
+        - columns: column names to index
+
+        Returns:
+
+        - self, for chaining
+        """
+        data = self._transformed_data
+        indexes = self._valid_indexes()
+        for column in columns:
+            index = {}
+            values = data.column(column) if isinstance(data, CompactRows) else (item.get(column) for item in data)
+            try:
+                for position, value in enumerate(values):
+                    index.setdefault(value, []).append(position)
+            except TypeError:
+                # Unhashable values can't be indexed. Filters on this column will scan the rows.
+                continue
+            indexes[column] = index
+        self._indexes = indexes
+        self._index_source = self._index_key(data)
+        return self
+
+
+    @staticmethod
+    def _index_key(data) -> tuple:
+        # CompactRows count every change to their rows. List rows changed without changing length aren't detected.
+        return (id(data), len(data), getattr(data, 'version', None))
+
+
+    def _valid_indexes(self) -> dict:
+        indexes = getattr(self, '_indexes', {})
+        data = self._transformed_data
+        if indexes and getattr(self, '_index_source', None) != self._index_key(data):
+            columns = list(indexes.keys())
+            self._indexes = {}
+            self.build_index(*columns)
+            indexes = self._indexes
+        return indexes
+
+
+    @staticmethod
+    def _compile_filter(key, value) -> tuple:
+        """
+        Convert a get_response_attribute filter into (exclude, values, predicate).
+
+        values is None when the filter can't be answered from an index.
+        """
+        if isinstance(value, list) and value and str(value[0]).startswith("!"):
+            exclude = True
+            values = [v[1:] if isinstance(v, str) and v.startswith("!") else v for v in value]
+        elif isinstance(value, str) and value.startswith("!"):
+            exclude = True
+            values = [value[1:]]
+        elif isinstance(value, list):
+            exclude = False
+            values = value
+        else:
+            exclude = False
+            values = [value]
+        try:
+            lookup = frozenset(values)
+        except TypeError:
+            lookup = values
+            values = None
+        if exclude:
+            predicate = lambda item: item.get(key) not in lookup
+        elif len(lookup) == 1 and values is not None:
+            target = values[0]
+            predicate = lambda item: item.get(key) == target
+        else:
+            predicate = lambda item: item.get(key) in lookup
+        return exclude, values, predicate
+
+
+    def _filter_rows(self, filters:dict) -> list:
+        data = self._transformed_data
+        if not filters:
+            return data
+        indexes = self._valid_indexes()
+        positions = None
+        excluded = set()
+        predicates = []
+        for key, value in filters.items():
+            exclude, values, predicate = self._compile_filter(key, value)
+            index = indexes.get(key)
+            if index is None or values is None:
+                predicates.append(predicate)
+                continue
+            matches = set()
+            for v in values:
+                try:
+                    matches.update(index.get(v, ()))
+                except TypeError:
+                    matches = None
+                    break
+            if matches is None:
+                predicates.append(predicate)
+            elif exclude:
+                excluded |= matches
+            else:
+                positions = matches if positions is None else positions & matches
+        if positions is None and not excluded:
+            rows = data
+        else:
+            if positions is None:
+                positions = range(len(data))
+            rows = [data[p] for p in sorted(positions) if p not in excluded]
+        if not predicates:
+            return list(rows)
+        return [item for item in rows if all(predicate(item) for predicate in predicates)]
 
 
     def get_response_attribute(self, attribute:Union[str,tuple[str]], preserve_list=False, **kwargs) -> list | str:
@@ -227,6 +882,7 @@ class DataSourceResponse(ABC):
         - preserve_list: Pass true to retain a list of attributes even if a single item is found.
         - kwargs: arbitrary number of attribute=value filters to use when searching for a specific attribute to return.
                   prefix the value filters with "!" if the value should be excluded.
+                  Filters on columns passed to build_index use the index instead of scanning every row.
 
         Returns:
 
@@ -237,19 +893,12 @@ class DataSourceResponse(ABC):
             attribute = (attribute,)
         
         attr_list = []
-        for item in self._transformed_data:
-            if not kwargs or all(
-                (item.get(k) not in v if isinstance(v, list) and v and str(v[0]).startswith("!") 
-                 else item.get(k) != v[1:] if isinstance(v, str) and v.startswith("!") 
-                 else item.get(k) in v if isinstance(v, list) 
-                 else item.get(k) == v)
-                for k, v in kwargs.items()
-            ):
-                # Extract attributes for each item as a tuple (even for a single attribute)
-                values = item if all_attr else tuple(item.get(attr) for attr in attribute)
-                # If single attribute, unpack the tuple, otherwise append the tuple
-                attr_list.append(values[0] if len(values) == 1 else values)
+        for item in self._filter_rows(kwargs):
+            # Extract attributes for each item as a tuple (even for a single attribute)
+            values = item if all_attr else tuple(item.get(attr) for attr in attribute)
+            # If single attribute, unpack the tuple, otherwise append the tuple
+            attr_list.append(values[0] if len(values) == 1 else values)
         if len(attr_list) == 0:
             return None
         return attr_list[0] if len(attr_list) == 1 and not preserve_list else attr_list
-    get_attribute = get_response_attribute
\ No newline at end of file
+    get_attribute = get_response_attribute
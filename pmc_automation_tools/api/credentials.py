@@ -0,0 +1,149 @@
+"""
+Process-wide cache of the web service credentials in pcn_config.json files.
+
+The file is read once and only read again after it changes on disk.
+"""
+import os
+import json
+import base64
+import threading
+from typing import Union, Dict
+
+from requests.auth import HTTPBasicAuth
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class CachedHTTPBasicAuth(HTTPBasicAuth):
+    """
+    HTTPBasicAuth which encodes the Authorization header once instead of on every request.
+    """
+    def __init__(self, username:str, password:str):
+        super().__init__(username, password)
+        self.header = _basic_auth_header(username, password)
+
+
+    def __call__(self, r):
+        r.headers['Authorization'] = self.header
+        return r
+
+
+def _basic_auth_header(username:str, password:str) -> str:
+    token = base64.b64encode(f'{username}:{password}'.encode('latin1')).decode('ascii')
+    return f'Basic {token}'
+
+
+class CredentialStore:
+    def __init__(self, path:str):
+        """
+        Credentials from one pcn_config.json file.
+
+        The file is checked for changes on each lookup and reloaded when its modified time or size changes.
+        Auth objects are created once per PCN reference and shared between threads.
+
+        Parameters:
+
+        - path: path to the JSON credential file.
+        """
+        self.path = os.path.abspath(path)
+        self.credentials = {}
+        self._auth = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+
+    def __repr__(self):
+        return f"CredentialStore(path={self.path}, keys={len(self.credentials)})"
+
+
+    def _stat(self) -> Union[tuple, None]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+    def _refresh(self) -> bool:
+        """Reload the file if it changed. Returns False if the file doesn't exist."""
+        signature = self._stat()
+        if signature == self._signature:
+            return signature is not None
+        with self._lock:
+            if signature != self._signature:
+                if signature is None:
+                    credentials = {}
+                else:
+                    with open(self.path, 'r', encoding='utf-8') as c:
+                        credentials = json.load(c)
+                self.credentials = credentials
+                self._auth = {}
+                self._signature = signature
+        return signature is not None
+
+
+    def exists(self) -> bool:
+        """Return True if the credential file exists."""
+        return self._refresh()
+
+
+    def get(self, key:str) -> Union[CachedHTTPBasicAuth, None]:
+        """
+        Return the auth object for a PCN reference, or None if the file or key doesn't exist.
+
+        The same object is returned until the file changes.
+        """
+        if not self._refresh():
+            return None
+        auth = self._auth.get(key)
+        if auth is not None:
+            return auth
+        # Read the credentials under the reload lock, so a reload running at the same time can't leave the old login cached.
+        with self._lock:
+            auth = self._auth.get(key)
+            if auth is None:
+                credentials = self.credentials
+                if key not in credentials.keys():
+                    return None
+                auth = self._auth[key] = CachedHTTPBasicAuth(credentials[key]['api_user'], credentials[key]['api_pass'])
+        return auth
+
+
+    def auth_header(self, key:str) -> Union[Dict[str, str], None]:
+        """
+        Return the prepared Authorization header for a PCN reference, or None if the file or key doesn't exist.
+        """
+        auth = self.get(key)
+        if auth is None:
+            return None
+        return {'Authorization': auth.header}
+
+
+    def keys(self) -> list:
+        """PCN references in the file."""
+        self._refresh()
+        return list(self.credentials.keys())
+
+
+def get_credential_store(path:str) -> CredentialStore:
+    """
+    Return the process-wide CredentialStore for a credential file, creating it on first use.
+    """
+    key = os.path.abspath(path)
+    store = _STORES.get(key)
+    if store is not None:
+        return store
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = CredentialStore(key)
+    return store
+
+
+def clear_credential_stores():
+    """
+    Forget every loaded credential file. Files are read again on the next lookup.
+    """
+    with _STORES_LOCK:
+        _STORES.clear()
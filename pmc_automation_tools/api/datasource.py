@@ -2,21 +2,19 @@ from pmc_automation_tools.api.common import (
     DataSourceInput,
     DataSourceResponse,
     DataSource,
-    CustomSslContextHTTPAdapter,
-    RETRY_COUNT,
-    BACKOFF,
-    RETRY_STATUSES
+    MAX_WORKERS
     )
+from pmc_automation_tools.api.retry import RetryPolicy
+from pmc_automation_tools.api.cache import READ_METHODS
 from pmc_automation_tools.common.exceptions import ApiError
-import requests
+from pmc_automation_tools.common.utils import json_loads
 from requests.exceptions import HTTPError
 
-from urllib3.util.retry import Retry
-
+import contextvars
 from itertools import chain
 from concurrent.futures import ThreadPoolExecutor
 
-from typing import List
+from typing import Generator
 from datetime import datetime
 
 TEST = 'https://test.connect.plex.com'
@@ -26,6 +24,7 @@ class ApiDataSourceInput(DataSourceInput):
     def __init__(self, url: str, method: str, *args, **kwargs):
         super().__init__(url, type='api', *args, **kwargs)
         self._method = method
+        self._pagination = None
     
     
     def __repr__(self):
@@ -39,7 +38,39 @@ class ApiDataSourceInput(DataSourceInput):
             self._query_string = self._query_string['json']
 
 
+    def set_pagination(self, page_size:int=1000,
+                       limit_param:str='limit',
+                       offset_param:str='offset',
+                       token_param:str=None,
+                       token_field:str=None,
+                       items_field:str=None):
+        """
+        Configure how ApiDataSource.call_data_source_paged requests each page.
+
+        Offset/limit paging is used unless token_param is provided.
+
+        Parameters:
+
+        - page_size: number of records requested per page
+        - limit_param: query parameter holding the page size
+        - offset_param: query parameter holding the record offset
+        - token_param: query parameter used to send the continuation token for the next page
+        - token_field: response key holding the continuation token. Defaults to token_param.
+        - items_field: response key holding the records if the API wraps them in an object.
+        """
+        self._pagination = {
+            'page_size': page_size,
+            'limit_param': limit_param,
+            'offset_param': offset_param,
+            'token_param': token_param,
+            'token_field': token_field or token_param,
+            'items_field': items_field
+        }
+
+
 class ApiDataSource(DataSource):
+    _call_errors = (ApiError,)
+
     def __init__(self, auth: str, *args, test_db: bool = True, **kwargs):
         """
         Parameters:
@@ -57,7 +88,39 @@ class ApiDataSource(DataSource):
         return f"ApiDataSource(auth={self.__auth_key__}, test_db={self._test_db})"
     
 
-    def call_data_source(self, pcn:str|list, query:ApiDataSourceInput):
+    def _call_pcn(self, pcn:str, query:ApiDataSourceInput, page_params:dict=None):
+        """
+        Call the API for a single PCN.
+
+        page_params are sent as additional query parameters.
+
+        Returns the response rows, or the raw response if the body is empty, along with the time taken.
+        """
+        start = datetime.now()
+        headers = {'Content-Type': 'application/json',
+            'X-Plex-Connect-Api-Key': self._auth,
+            'X-Plex-Connect-Customer-Id': pcn
+        }
+        request_params = {'json': query._query_string} if query._method.upper() in ['POST', 'PUT'] else {'params': query._query_string}
+        if page_params:
+            request_params['params'] = {**request_params.get('params', {}), **page_params}
+        response = self._get_session().request(query._method, query.__api_id__, headers=headers, **request_params)
+        body = json_loads(response.content) if response.content else None
+        try:
+            response.raise_for_status()
+        except HTTPError as e:
+            raise ApiError('Error calling API.', **(body if isinstance(body, dict) else {}), status=response.status_code, pcn=pcn)
+        # List of dictionaries or single dictionary object
+        if body is None:
+            rows = response
+        elif type(body) is list:
+            rows = body
+        else:
+            rows = [body]
+        return rows, datetime.now() - start
+
+
+    def call_data_source(self, pcn:str|list, query:ApiDataSourceInput, max_workers:int=MAX_WORKERS, use_cache:bool=True, retry:RetryPolicy=None):
         """
         Returns a list of the json objects as dictionaries from the API response.
 
@@ -65,52 +128,133 @@ class ApiDataSource(DataSource):
 
         - pcn: str | list
             - Single PCN number or list of PCNs to run the query against
+            - A list of PCNs is called concurrently. Each row is tagged with its PCN in a "pcn" key.
 
         - query: ApiDataSourceInput
             - DataSourceInput containing the connection parameters
+
+        - max_workers: int, optional
+            - Number of PCNs to call at the same time when a list is provided.
+
+        - use_cache: bool, optional
+            - Answer from the data source's ResponseCache when one is set. Only GET requests are cached.
+
+        - retry: RetryPolicy, optional
+            - Retry, timeout, and deadline settings for this call. Defaults to the data source's policy.
+            - The deadline covers every PCN in the list.
+
+        Returns:
+
+        - ApiDataSourceResponse object
+            - time_taken is a timedelta for a single PCN, or a dictionary of PCN:timedelta for a list of PCNs.
         """
-        start = datetime.now()
         if self._test_db:
             query.__api_id__ = query.__api_id__.replace(PROD, TEST)
-        response_list = []
+        read_only = query._method.upper() in READ_METHODS
+        pcn_key = pcn if isinstance(pcn, str) else tuple(pcn)
+        return self._cached_call(query, lambda: self._call_data_source(pcn, query, max_workers), pcn_key, query._method.upper(),
+                                 use_cache=use_cache and read_only, retry=retry)
+
+
+    def _can_coalesce(self, query:ApiDataSourceInput) -> bool:
+        # Only read requests are shared, unless coalesce=False. Identical POST/PUT calls are each sent.
+        return self._coalesce is not False and query._method.upper() in READ_METHODS
+
+
+    def _call_data_source(self, pcn:str|list, query:ApiDataSourceInput, max_workers:int):
+        start = datetime.now()
         if isinstance(pcn, str):
-            pcn_list = [pcn]
-        for p in pcn_list:
-            headers = {'Content-Type': 'application/json',
-                'X-Plex-Connect-Api-Key': self._auth,
-                'X-Plex-Connect-Customer-Id': p
-            }
-            session = requests.Session()
-            retry = Retry(total=RETRY_COUNT, connect=RETRY_COUNT, backoff_factor=BACKOFF, status_forcelist=RETRY_STATUSES, raise_on_status=True)
-            adapter = CustomSslContextHTTPAdapter(max_retries=retry)
-            session.mount('https://', adapter)
-            request_params = {'json': query._query_string} if query._method.upper() in ['POST', 'PUT'] else {'params': query._query_string}
-            response = session.request(query._method, query.__api_id__, headers=headers, **request_params)
-            try:
-                response.raise_for_status()
-            except HTTPError as e:
-                raise ApiError('Error calling API.', **response.json(), status=response.status_code)
-            # List of dictionaries or single dictionary object
-            if response.text != [] and response.text != '':
-                    if type(response.json()) is list:
-                        response_list.append(response.json())
-                    else:
-                        response_list.append([response.json()])
-            else:
-                return response
-        end = datetime.now() - start
-        return ApiDataSourceResponse(query.__api_id__, response_list = list(chain.from_iterable(response_list)), time_taken = end)
-
-
-    def call_data_source_threaded(self, query_list:List['ApiDataSourceInput']) -> List['ApiDataSourceResponse']:
-        def error_safe_call(query):
-            try:
-                return self.call_data_source(query)
-            except ApiError as e:
-                return e
-        with ThreadPoolExecutor(max_workers=8) as pool:
-            response_list = list(pool.map(error_safe_call, query_list))
-        return response_list  
+            rows, _ = self._call_pcn(pcn, query)
+            if not isinstance(rows, list):
+                return rows
+            end = datetime.now() - start
+            return ApiDataSourceResponse(query.__api_id__, response_list = rows, time_taken = end)
+        pcn_list = list(pcn)
+        # Each worker runs in a copy of the caller's context so the call's retry policy and deadline apply to every PCN.
+        contexts = [contextvars.copy_context() for _ in pcn_list]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pcn_list)))) as pool:
+            results = list(pool.map(lambda p, ctx: ctx.run(self._call_pcn, p, query), pcn_list, contexts))
+        response_list = []
+        time_taken = {}
+        for p, (rows, elapsed) in zip(pcn_list, results):
+            time_taken[p] = elapsed
+            if not isinstance(rows, list):
+                continue
+            for row in rows:
+                if isinstance(row, dict):
+                    row['pcn'] = p
+            response_list.append(rows)
+        return ApiDataSourceResponse(query.__api_id__, response_list = list(chain.from_iterable(response_list)), time_taken = time_taken)
+
+
+    def call_data_source_paged(self, pcn:str, query:ApiDataSourceInput, prefetch:bool=False, retry:RetryPolicy=None) -> Generator['ApiDataSourceResponse', None, None]:
+        """
+        Yields one ApiDataSourceResponse per page until the API runs out of records.
+
+        Uses the paging configured with ApiDataSourceInput.set_pagination, or offset/limit paging with 1000 records per page.
+
+        Parameters:
+
+        - pcn: str
+            - PCN number to run the query against
+
+        - query: ApiDataSourceInput
+            - DataSourceInput containing the connection parameters
+
+        - prefetch: bool, optional
+            - Request the next page in the background while the current page is being processed.
+
+        - retry: RetryPolicy, optional
+            - Retry, timeout, and deadline settings for each page request. Defaults to the data source's policy.
+        """
+        if self._test_db:
+            query.__api_id__ = query.__api_id__.replace(PROD, TEST)
+        if query._pagination is None:
+            query.set_pagination()
+        paging = query._pagination
+        page_size = paging['page_size']
+
+        def fetch(page_params):
+            rows, elapsed = self._guarded_call(query, lambda: self._call_pcn(pcn, query, page_params), retry)
+            if not isinstance(rows, list):
+                return [], None, elapsed
+            token = None
+            if paging['token_field'] or paging['items_field']:
+                body = rows[0] if rows and isinstance(rows[0], dict) else {}
+                if paging['token_field']:
+                    token = body.get(paging['token_field'])
+                if paging['items_field']:
+                    rows = body.get(paging['items_field']) or []
+            return rows, token, elapsed
+
+        def next_params(page_params, rows, token):
+            if paging['token_param']:
+                if not token or not rows:
+                    return None
+                return {paging['limit_param']: page_size, paging['token_param']: token}
+            if len(rows) < page_size:
+                return None
+            return {paging['limit_param']: page_size, paging['offset_param']: page_params[paging['offset_param']] + page_size}
+
+        page_params = {paging['limit_param']: page_size}
+        if not paging['token_param']:
+            page_params[paging['offset_param']] = 0
+        page = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(fetch, page_params)
+            while future is not None:
+                rows, token, elapsed = future.result()
+                following = next_params(page_params, rows, token)
+                future = None
+                if following is not None and prefetch:
+                    future = pool.submit(fetch, following)
+                if rows:
+                    yield ApiDataSourceResponse(query.__api_id__, response_list = rows, time_taken = elapsed, page = page)
+                if following is not None and not prefetch:
+                    future = pool.submit(fetch, following)
+                page_params = following
+                page += 1
+
 
 class ApiDataSourceResponse(DataSourceResponse):
     def __init__(self, url, **kwargs):
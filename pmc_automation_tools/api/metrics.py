@@ -0,0 +1,410 @@
+"""
+Per-call timing and size metrics for data source calls.
+
+Pass one or more sinks to a data source with the metrics parameter. After every call to Plex each sink is called with a CallMetrics object.
+Any callable taking one argument works as a sink. PrometheusTextFileSink and LogSink are provided.
+
+Phases are measured for each HTTP request and summed over the call:
+
+- dns: resolving the host name. Only new connections resolve the host.
+- connect: opening the TCP connection.
+- tls: the TLS handshake.
+- server: sending the request and waiting for the response headers, including waits between urllib3 retries.
+- transfer: reading the response body.
+- parse: time in the call outside of HTTP requests, mostly decoding the body and building the response.
+"""
+import os
+import time
+import socket
+import atexit
+import logging
+import tempfile
+import threading
+import weakref
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Iterable, Union
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from pmc_automation_tools.common.utils import json_dumps
+
+PHASES = ('dns', 'connect', 'tls', 'server', 'transfer', 'parse')
+
+_CURRENT_METRICS = contextvars.ContextVar('pmc_automation_tools_current_metrics', default=None)
+# Connection phases of the HTTP request being sent in this thread or task.
+_CURRENT_REQUEST = contextvars.ContextVar('pmc_automation_tools_current_request', default=None)
+
+logger = logging.getLogger(__name__)
+
+# PrometheusTextFileSinks still in use, written once more when the process exits.
+_FILE_SINKS = weakref.WeakSet()
+
+
+class CallMetrics:
+    """
+    Timings in seconds, sizes in bytes, and counts for one data source call.
+    """
+    def __init__(self, type:str, data_source, endpoint:str=None):
+        self.type = type
+        self.data_source = str(data_source)
+        self.endpoint = endpoint
+        self.started = time.time()
+        self.total = 0.0
+        for phase in PHASES:
+            setattr(self, phase, 0.0)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.requests = 0
+        self.connections = 0
+        self.retries = 0
+        self.rows = None
+        self.status = None
+        self.error = None
+        self._http_by_thread = {}
+        self._lock = threading.Lock()
+
+
+    def __repr__(self):
+        _attrs = [f"{k}={v}" for k, v in self.as_dict().items()]
+        return f"CallMetrics({', '.join(_attrs)})"
+
+
+    def as_dict(self) -> dict:
+        return {k: v for k, v in vars(self).items() if not k.startswith('_')}
+
+
+    def add(self, **values):
+        """Add to any of the timings or counters. Safe to call from several threads."""
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+    def _add_request(self, timer:dict, elapsed:float, request_bytes:int, response_bytes:int, status:int):
+        connecting = timer['dns'] + timer['connect'] + timer['tls']
+        thread = threading.get_ident()
+        with self._lock:
+            self.dns += timer['dns']
+            self.connect += timer['connect']
+            self.tls += timer['tls']
+            self.server += max(0.0, elapsed - connecting - timer['transfer'])
+            self.transfer += timer['transfer']
+            self.connections += timer['connections']
+            self.request_bytes += request_bytes
+            self.response_bytes += response_bytes
+            self.requests += 1
+            self.status = status
+            self._http_by_thread[thread] = self._http_by_thread.get(thread, 0.0) + elapsed
+
+
+    def _finish(self, total:float, error:BaseException=None):
+        self.total = total
+        # Requests for several PCNs run in parallel threads, so the busiest thread stands in for the time spent on HTTP.
+        self.parse = max(0.0, total - max(self._http_by_thread.values(), default=0.0))
+        if error is not None:
+            self.error = type(error).__name__
+
+
+def row_count(response) -> Union[int, None]:
+    """Number of rows in a response without building the rows of a lazy response."""
+    attrs = getattr(response, '__dict__', {})
+    count = attrs.get('_row_count')
+    if count is None and attrs.get('_transformed_data') is not None:
+        count = len(attrs['_transformed_data'])
+    return count
+
+
+def current_metrics() -> Union[CallMetrics, None]:
+    """Return the CallMetrics of the running data source call, or None if the call isn't measured."""
+    return _CURRENT_METRICS.get()
+
+
+@contextmanager
+def measure(sinks:list, type:str, data_source, endpoint:str=None):
+    """
+    Measure the data source call made inside the block and send the result to every sink.
+
+    Yields the CallMetrics, or None if there are no sinks.
+    """
+    if not sinks:
+        yield None
+        return
+    metrics = CallMetrics(type, data_source, endpoint)
+    token = _CURRENT_METRICS.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except BaseException as e:
+        metrics._finish(time.perf_counter() - start, error=e)
+        raise
+    else:
+        metrics._finish(time.perf_counter() - start)
+    finally:
+        _CURRENT_METRICS.reset(token)
+        emit(sinks, metrics)
+
+
+def emit(sinks:list, metrics:CallMetrics):
+    # A failing sink is logged instead of failing the data source call.
+    for sink in sinks:
+        try:
+            sink(metrics)
+        except Exception:
+            logger.exception('Metrics sink %r failed.', sink)
+
+
+def get_sinks(metrics:Union[Callable, Iterable[Callable], None]) -> list:
+    if metrics is None:
+        return []
+    if callable(metrics):
+        return [metrics]
+    return list(metrics)
+
+
+def send_timed(send, request, stream:bool=False, **kwargs):
+    """
+    Call an HTTPAdapter's send and add the request's timings to the running call's metrics.
+    """
+    metrics = _CURRENT_METRICS.get()
+    if metrics is None:
+        return send(request, stream=stream, **kwargs)
+    timer = {'dns': 0.0, 'connect': 0.0, 'tls': 0.0, 'transfer': 0.0, 'connections': 0}
+    token = _CURRENT_REQUEST.set(timer)
+    start = time.perf_counter()
+    try:
+        response = send(request, stream=stream, **kwargs)
+    finally:
+        _CURRENT_REQUEST.reset(token)
+    response_bytes = 0
+    if not stream:
+        # requests reads the body right after send returns, so reading it here only moves the time into transfer.
+        received = time.perf_counter()
+        response_bytes = len(response.content or b'')
+        timer['transfer'] = time.perf_counter() - received
+    body = request.body or b''
+    request_bytes = len(body.encode('utf-8') if isinstance(body, str) else body) if isinstance(body, (str, bytes)) else 0
+    metrics._add_request(timer, time.perf_counter() - start, request_bytes, response_bytes, response.status_code)
+    return response
+
+
+def add_traced_request(metrics:CallMetrics, trace:dict, request_bytes:int, response_bytes:int, status:int, transfer:float=0.0):
+    """
+    Add an aiohttp request traced with aiohttp_trace_config to the call's metrics.
+    """
+    if not trace or 'headers' not in trace:
+        return
+    timer = trace['timer']
+    timer['transfer'] = transfer
+    metrics._add_request(timer, trace['headers'] - trace['start'] + transfer, request_bytes, response_bytes, status)
+
+
+class _TimedConnectionMixin:
+    """Records DNS, connect, and TLS time for connections opened during a measured call."""
+    def _new_conn(self):
+        timer = _CURRENT_REQUEST.get()
+        if timer is None:
+            return super()._new_conn()
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host.strip('[]'), self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            # urllib3 resolves again and raises its usual error.
+            return super()._new_conn()
+        finally:
+            resolved = time.perf_counter()
+            timer['dns'] += resolved - start
+        # Connect to the resolved addresses so the lookup isn't timed as part of connecting.
+        # self.host follows _dns_host, so it is restored before the TLS handshake reads it.
+        error = None
+        try:
+            for address in dict.fromkeys(info[4][0] for info in addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except Exception as e:
+                    error = e
+            raise error
+        finally:
+            self._dns_host = host
+            timer['connect'] += time.perf_counter() - resolved
+            timer['connections'] += 1
+
+
+    def connect(self):
+        timer = _CURRENT_REQUEST.get()
+        if timer is None or not isinstance(self, HTTPSConnection):
+            return super().connect()
+        before = timer['dns'] + timer['connect']
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            connecting = timer['dns'] + timer['connect'] - before
+            timer['tls'] += max(0.0, time.perf_counter() - start - connecting)
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):...
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):...
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+POOL_CLASSES = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+def aiohttp_trace_config():
+    """
+    aiohttp TraceConfig recording DNS, connect, and server time into the CallMetrics passed as trace_request_ctx.
+
+    aiohttp doesn't report the TLS handshake separately, so it is included in connect.
+    """
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+        context.timer = {'dns': 0.0, 'connect': 0.0, 'tls': 0.0, 'transfer': 0.0, 'connections': 0}
+
+    async def on_dns_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_end(session, context, params):
+        context.timer['dns'] += time.perf_counter() - context.dns_start
+
+    async def on_connection_start(session, context, params):
+        context.connection_start = time.perf_counter()
+        context.dns_before = context.timer['dns']
+
+    async def on_connection_end(session, context, params):
+        dns = context.timer['dns'] - context.dns_before
+        context.timer['connect'] += max(0.0, time.perf_counter() - context.connection_start - dns)
+        context.timer['connections'] += 1
+
+    async def on_request_end(session, context, params):
+        context.trace_request_ctx['headers'] = time.perf_counter()
+        context.trace_request_ctx['timer'] = context.timer
+        context.trace_request_ctx['start'] = context.start
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_start.append(on_connection_start)
+    trace_config.on_connection_create_end.append(on_connection_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusTextFileSink:
+    def __init__(self, path:str, interval:float=10.0, prefix:str='pmc_datasource'):
+        """
+        Keep running totals per data source and write them in the Prometheus text format.
+
+        The file is replaced in one step, so it can be read by the node_exporter textfile collector while calls are running.
+
+        Parameters:
+
+        - path: file to write. Use a .prom extension for the textfile collector.
+        - interval: least seconds between writes. The file is always written by flush(), and when the process exits if the sink is still in use.
+        - prefix: prefix for the metric names.
+        """
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self._calls = {}
+        self._totals = {}
+        self._written = 0.0
+        self._lock = threading.Lock()
+        _FILE_SINKS.add(self)
+
+
+    def __call__(self, metrics:CallMetrics):
+        labels = (metrics.type, metrics.data_source)
+        with self._lock:
+            outcome = labels + ('error' if metrics.error else 'ok',)
+            self._calls[outcome] = self._calls.get(outcome, 0) + 1
+            totals = self._totals.setdefault(labels, dict.fromkeys(PHASES + ('total', 'request_bytes', 'response_bytes', 'retries', 'rows'), 0))
+            for name in totals:
+                totals[name] += getattr(metrics, name) or 0
+            due = time.monotonic() - self._written >= self.interval
+        if due:
+            self.flush()
+
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [f'# HELP {p}_calls_total Data source calls sent to Plex.', f'# TYPE {p}_calls_total counter']
+        with self._lock:
+            calls = dict(self._calls)
+            totals = {labels: dict(values) for labels, values in self._totals.items()}
+        for (type, data_source, outcome), count in sorted(calls.items()):
+            lines.append(f'{p}_calls_total{{type="{type}",data_source="{_escape(data_source)}",outcome="{outcome}"}} {count}')
+        series = [('seconds_total', 'Seconds spent in each phase of the calls.', PHASES + ('total',), 'phase'),
+                  ('bytes_total', 'Request and response body bytes.', ('request_bytes', 'response_bytes'), 'direction'),
+                  ('retries_total', 'Retried requests.', ('retries',), None),
+                  ('rows_total', 'Rows returned.', ('rows',), None)]
+        for suffix, help_text, names, label in series:
+            lines.append(f'# HELP {p}_{suffix} {help_text}')
+            lines.append(f'# TYPE {p}_{suffix} counter')
+            for (type, data_source), values in sorted(totals.items()):
+                base = f'type="{type}",data_source="{_escape(data_source)}"'
+                for name in names:
+                    extra = f',{label}="{name.replace("_bytes", "")}"' if label else ''
+                    lines.append(f'{p}_{suffix}{{{base}{extra}}} {values[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+    def flush(self):
+        """Write the totals to the file now."""
+        text = self.render()
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._written = time.monotonic()
+
+
+@atexit.register
+def _flush_file_sinks():
+    for sink in list(_FILE_SINKS):
+        try:
+            sink.flush()
+        except OSError:
+            logger.exception('Could not write metrics to %s', sink.path)
+
+
+class LogSink:
+    def __init__(self, logger:Union[logging.Logger, str]='pmc_automation_tools.metrics', level:int=logging.INFO):
+        """
+        Log one JSON line per data source call.
+
+        Parameters:
+
+        - logger: logger or logger name.
+        - level: log level for the lines.
+        """
+        self.logger = logging.getLogger(logger) if isinstance(logger, str) else logger
+        self.level = level
+
+
+    def __call__(self, metrics:CallMetrics):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json_dumps(metrics.as_dict(), default=str))
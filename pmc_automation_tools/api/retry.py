@@ -0,0 +1,286 @@
+"""
+Retry, timeout, and circuit breaker settings for data source calls.
+
+A RetryPolicy can be set per data source and overridden per call. The policy for the running call is kept in a
+context variable so the HTTP adapters, which are shared by every call on a session, can apply it.
+"""
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Iterable, Union
+
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError
+
+from pmc_automation_tools.common.exceptions import CircuitOpenError, DeadlineExceededError
+from pmc_automation_tools.api.metrics import current_metrics
+
+RETRY_COUNT = 10
+BACKOFF = 0.5
+# Random extra seconds added to each retry so threads that failed together don't retry together.
+BACKOFF_JITTER = 0.5
+BACKOFF_MAX = 120
+RETRY_STATUSES = [500, 502, 503, 504]
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+_CURRENT_CALL = contextvars.ContextVar('pmc_automation_tools_current_call', default=None)
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+class _DeadlineRetry(Retry):
+    """urllib3 Retry which stops retrying once the call's deadline has passed."""
+    def __init__(self, *args, deadline:float=None, **kwargs):
+        self.deadline = deadline
+        super().__init__(*args, **kwargs)
+
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.deadline = self.deadline
+        return retry
+
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise MaxRetryError(_pool, url, DeadlineExceededError('Retry deadline exceeded.'))
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add(retries=1)
+        return retry
+
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        if self.deadline is not None:
+            backoff = min(backoff, max(0.0, self.deadline - time.monotonic()))
+        return backoff
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an endpoint after repeated failures.
+
+    After failure_threshold failures in a row the circuit opens and calls fail immediately with CircuitOpenError.
+    Once reset_timeout seconds pass, one trial call is let through. Success closes the circuit, failure opens it again.
+    """
+    def __init__(self, endpoint:str, failure_threshold:int=FAILURE_THRESHOLD, reset_timeout:float=RESET_TIMEOUT):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+
+    def __repr__(self):
+        return f"CircuitBreaker(endpoint={self.endpoint}, state={self.state}, failures={self.failures})"
+
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError if the endpoint shouldn't be called right now.
+
+        Returns True if the call is the half-open trial. Pass that to end_call() in a finally block.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return False
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(f'Circuit open for {self.endpoint} after {self.failures} failures. Retry in {retry_in:.0f} seconds.',
+                                   endpoint=self.endpoint, retry_in=retry_in)
+
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+
+    def end_call(self, trial:bool):
+        """
+        Let another trial through if the trial call ended without recording a result, such as when it was cancelled.
+        """
+        if trial:
+            with self._lock:
+                self._trial_running = False
+
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+    def reset(self):
+        self.record_success()
+
+
+def get_circuit_breaker(endpoint:str, failure_threshold:int=FAILURE_THRESHOLD, reset_timeout:float=RESET_TIMEOUT) -> CircuitBreaker:
+    """
+    Return the process-wide CircuitBreaker for an endpoint and settings, creating it on first use.
+
+    Policies with different failure_threshold or reset_timeout values get separate breakers for the same endpoint.
+    """
+    key = (endpoint, failure_threshold, reset_timeout)
+    breaker = _BREAKERS.get(key)
+    if breaker is not None:
+        return breaker
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(key)
+        if breaker is None:
+            breaker = _BREAKERS[key] = CircuitBreaker(endpoint, failure_threshold, reset_timeout)
+    return breaker
+
+
+def reset_circuit_breakers():
+    """
+    Close every circuit breaker.
+    """
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
+
+
+class RetryPolicy:
+    def __init__(self, total:int=RETRY_COUNT,
+                 backoff:float=BACKOFF,
+                 backoff_jitter:float=BACKOFF_JITTER,
+                 backoff_max:float=BACKOFF_MAX,
+                 statuses:Iterable[int]=RETRY_STATUSES,
+                 connect_timeout:float=CONNECT_TIMEOUT,
+                 read_timeout:float=READ_TIMEOUT,
+                 deadline:float=None,
+                 idempotent_only:bool=True,
+                 failure_threshold:Union[int, None]=None,
+                 reset_timeout:float=RESET_TIMEOUT):
+        """
+        Retry, timeout, and circuit breaker settings for data source calls.
+
+        Parameters:
+
+        - total: most retries for a call.
+        - backoff: exponential backoff factor in seconds. Retry n waits backoff * 2^(n-1).
+        - backoff_jitter: up to this many random seconds are added to each wait.
+        - backoff_max: longest wait between retries.
+        - statuses: HTTP statuses which are retried.
+        - connect_timeout: seconds to wait for a connection.
+        - read_timeout: seconds to wait for the server to send data.
+        - deadline: total seconds a call may take including every retry. No limit if None.
+        - idempotent_only: only retry failed requests that are safe to send again, which are GET/PUT/DELETE style requests.
+                           UX and Classic data sources are called with POST. For POST only failed connections and
+                           connect timeouts are retried, since the request was never sent. Read timeouts, dropped
+                           connections, and failed statuses are raised right away because Plex may already have run the request.
+                           Set this to False to retry them too.
+        - failure_threshold: failed calls in a row before an endpoint's circuit opens. None (default) disables the circuit breaker.
+                             FAILURE_THRESHOLD is a reasonable starting value.
+        - reset_timeout: seconds an open circuit waits before letting a trial call through.
+        """
+        self.total = total
+        self.backoff = backoff
+        self.backoff_jitter = backoff_jitter
+        self.backoff_max = backoff_max
+        self.statuses = list(statuses)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.idempotent_only = idempotent_only
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+
+    def __repr__(self):
+        _attrs = [f"{k}={v}" for k, v in vars(self).items()]
+        return f"RetryPolicy({', '.join(_attrs)})"
+
+
+    def backoff_time(self, attempt:int) -> float:
+        """Seconds to wait before retry number attempt, matching urllib3's backoff with jitter. The first retry is immediate."""
+        if attempt <= 1:
+            return 0
+        return min(self.backoff_max, self.backoff * (2 ** (attempt - 1)) + random.uniform(0, self.backoff_jitter))
+
+
+    def urllib3_retry(self, deadline:float=None, exclude_statuses:Iterable[int]=()) -> Retry:
+        """
+        Build the urllib3 Retry for this policy.
+
+        Parameters:
+
+        - deadline: time.monotonic() value when retrying stops.
+        - exclude_statuses: statuses handled somewhere else, such as throttling handled by the rate limiter.
+        """
+        kwargs = {} if self.idempotent_only else {'allowed_methods': None}
+        return _DeadlineRetry(total=self.total, connect=self.total, backoff_factor=self.backoff,
+                              backoff_jitter=self.backoff_jitter, backoff_max=self.backoff_max,
+                              status_forcelist=[s for s in self.statuses if s not in exclude_statuses],
+                              raise_on_status=True, deadline=deadline, **kwargs)
+
+
+    def timeout(self, deadline:float=None) -> tuple:
+        """
+        (connect, read) timeouts for requests. Both are shortened to fit in the time left before the deadline.
+        """
+        connect, read = self.connect_timeout, self.read_timeout
+        if deadline is not None:
+            remaining = max(0.001, deadline - time.monotonic())
+            connect = remaining if connect is None else min(connect, remaining)
+            read = remaining if read is None else min(read, remaining)
+        return connect, read
+
+
+    def circuit_breaker(self, endpoint:str) -> Union[CircuitBreaker, None]:
+        if not self.failure_threshold:
+            return None
+        return get_circuit_breaker(endpoint, self.failure_threshold, self.reset_timeout)
+
+
+class CallContext:
+    """Retry policy and deadline for the data source call running in this thread or task."""
+    __slots__ = ('policy', 'deadline', 'retries')
+
+    def __init__(self, policy:RetryPolicy):
+        self.policy = policy
+        self.deadline = None if policy.deadline is None else time.monotonic() + policy.deadline
+        self.retries = 0
+
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+def current_call() -> Union[CallContext, None]:
+    """Return the CallContext for the running data source call, or None outside of a call."""
+    return _CURRENT_CALL.get()
+
+
+@contextmanager
+def call_context(policy:RetryPolicy):
+    context = CallContext(policy)
+    token = _CURRENT_CALL.set(context)
+    try:
+        yield context
+    finally:
+        _CURRENT_CALL.reset(token)
@@ -0,0 +1,284 @@
+"""
+Compact row storage for large data source responses.
+
+Rows are stored as one list of values per column with a single shared list of column names,
+instead of one dictionary per row repeating every column name.
+"""
+from collections.abc import Mapping, MutableMapping, MutableSequence, Sequence
+from typing import Iterable, Iterator, Generator, List, Any
+
+
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<missing>'
+
+
+# Marks a column that isn't present in a row. Rows from the Plex APIs don't always share the same keys.
+MISSING = _Missing()
+
+# Maximum number of distinct strings remembered for sharing repeated values.
+STRING_CACHE_SIZE = 65536
+
+
+class CompactRow(MutableMapping):
+    """
+    Dictionary-like view of one row in a CompactRows container.
+
+    Reads and writes go straight to the container's column lists. Use dict(row) for a standalone copy.
+    """
+    __slots__ = ('_rows', '_index')
+
+    def __init__(self, rows:'CompactRows', index:int):
+        self._rows = rows
+        self._index = index
+
+
+    def __getitem__(self, key):
+        column = self._rows._columns.get(key)
+        if column is None:
+            raise KeyError(key)
+        value = column[self._index]
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+
+    def get(self, key, default=None):
+        column = self._rows._columns.get(key)
+        if column is None:
+            return default
+        value = column[self._index]
+        return default if value is MISSING else value
+
+
+    def __setitem__(self, key, value):
+        self._rows._column(key)[self._index] = value
+        self._rows.version += 1
+
+
+    def __delitem__(self, key):
+        column = self._rows._columns.get(key)
+        if column is None or column[self._index] is MISSING:
+            raise KeyError(key)
+        column[self._index] = MISSING
+        self._rows.version += 1
+
+
+    def __iter__(self) -> Iterator[str]:
+        index = self._index
+        return (name for name, column in self._rows._columns.items() if column[index] is not MISSING)
+
+
+    def __len__(self):
+        index = self._index
+        return sum(1 for column in self._rows._columns.values() if column[index] is not MISSING)
+
+
+    def __contains__(self, key):
+        column = self._rows._columns.get(key)
+        return column is not None and column[self._index] is not MISSING
+
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+    def __reduce__(self):
+        # Pickle as a plain dictionary instead of pulling in the whole container.
+        return (dict, (dict(self),))
+
+
+class CompactRows(MutableSequence):
+    """
+    List-like container of response rows stored as column lists.
+
+    Indexing and iteration return CompactRow views which behave like the row dictionaries.
+    Repeated string values, such as status or building codes, are stored as one shared string object.
+    """
+    # Increased whenever rows or stored values change, so indexes built on the rows know to rebuild.
+    version = 0
+
+    def __init__(self, rows:Iterable[Mapping]=None):
+        """
+        Parameters:
+
+        - rows: optional iterable of dictionaries to load. Generators are read one row at a time.
+        """
+        self._columns = {}
+        self._length = 0
+        self._strings = {}
+        if rows is not None:
+            self.extend(rows)
+
+
+    @classmethod
+    def from_columns(cls, columns:Mapping[str, List[Any]]) -> 'CompactRows':
+        """
+        Build a container from a column name: list of values mapping. Every list must be the same length.
+        """
+        self = cls()
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns must be the same length.')
+        self._columns = {name: list(values) for name, values in columns.items()}
+        self._length = lengths.pop() if lengths else 0
+        return self
+
+
+    @property
+    def columns(self) -> List[str]:
+        """Column names in the order they were first seen."""
+        return list(self._columns)
+
+
+    def column(self, name:str, default:Any=None) -> list:
+        """
+        Return the values of one column. Rows without the column return default.
+
+        Pass default=MISSING to tell missing values apart from None, such as when passing the values back to set_column.
+        """
+        values = self._columns.get(name)
+        if values is None:
+            return [default] * self._length
+        if default is MISSING:
+            return list(values)
+        return [default if value is MISSING else value for value in values]
+
+
+    def set_column(self, name:str, values:Iterable[Any]):
+        """
+        Replace the values of one column. values must have one value per row. Use MISSING for rows without the column.
+
+        Indexes built on the rows, such as by DataSourceResponse.build_index, are rebuilt the next time they are used.
+        """
+        values = list(values)
+        if len(values) != self._length:
+            raise ValueError(f'Column {name} has {len(values)} values for {self._length} rows.')
+        self._columns[name] = values
+        self.version += 1
+
+
+    def _column(self, name:str) -> list:
+        column = self._columns.get(name)
+        if column is None:
+            column = self._columns[name] = [MISSING] * self._length
+        return column
+
+
+    def __len__(self):
+        return self._length
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CompactRows.from_columns({name: column[index] for name, column in self._columns.items()})
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('row index out of range')
+        return CompactRow(self, index)
+
+
+    def __iter__(self) -> Iterator[CompactRow]:
+        for index in range(self._length):
+            yield CompactRow(self, index)
+
+
+    def __setitem__(self, index, row:Mapping):
+        if isinstance(index, slice):
+            raise TypeError('CompactRows does not support slice assignment.')
+        target = self[index]
+        for name, column in self._columns.items():
+            column[target._index] = MISSING
+        for key, value in row.items():
+            self._column(key)[target._index] = self._share(value)
+        self.version += 1
+
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            for i in sorted(range(*index.indices(self._length)), reverse=True):
+                del self[i]
+            return
+        index = self[index]._index
+        for column in self._columns.values():
+            del column[index]
+        self._length -= 1
+        self.version += 1
+
+
+    def _share(self, value):
+        if type(value) is not str:
+            return value
+        shared = self._strings.get(value)
+        if shared is not None:
+            return shared
+        if len(self._strings) < STRING_CACHE_SIZE:
+            self._strings[value] = value
+        return value
+
+
+    def insert(self, index:int, row:Mapping):
+        index = max(0, min(self._length, index + self._length if index < 0 else index))
+        for column in self._columns.values():
+            column.insert(index, MISSING)
+        self._length += 1
+        for key, value in row.items():
+            self._column(key)[index] = self._share(value)
+        self.version += 1
+
+
+    def append(self, row:Mapping):
+        columns = self._columns
+        if row.keys() == columns.keys():
+            # Usual case, the row has the same columns as the rows before it.
+            share = self._share
+            for key, value in row.items():
+                columns[key].append(share(value))
+            self._length += 1
+            self.version += 1
+            return
+        index = self._length
+        for column in self._columns.values():
+            column.append(MISSING)
+        self._length += 1
+        for key, value in row.items():
+            self._column(key)[index] = self._share(value)
+        self.version += 1
+
+
+    def extend(self, rows:Iterable[Mapping]):
+        for row in rows:
+            self.append(row)
+
+
+    def iter_dicts(self) -> Generator[dict, None, None]:
+        """
+        Yield each row as a new dictionary.
+        """
+        if not self._columns:
+            for _ in range(self._length):
+                yield {}
+            return
+        names = list(self._columns)
+        for values in zip(*self._columns.values()):
+            yield {name: value for name, value in zip(names, values) if value is not MISSING}
+
+
+    def to_list(self) -> List[dict]:
+        """
+        Convert back to a list of dictionaries.
+        """
+        return list(self.iter_dicts())
+
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self.iter_dicts(), other))
+
+
+    def __repr__(self):
+        return f"CompactRows(rows={self._length}, columns={self.columns})"
@@ -0,0 +1,231 @@
+"""
+Client-side rate limiting for Plex web service accounts.
+
+Plex throttles each web service account. A RateLimiter combines a token bucket, which limits the request rate,
+with an AIMD (additive increase, multiplicative decrease) concurrency limit. Both double each round until Plex first
+throttles, then grow slowly while requests succeed and are halved when Plex answers with 429 or 503,
+so bulk jobs settle just under the rate the server accepts.
+
+Limiters are shared per credential across every data source in the process. See get_rate_limiter.
+"""
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Union
+
+THROTTLE_STATUSES = [429, 503]
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 120
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def parse_retry_after(value:str) -> Union[float, None]:
+    """
+    Convert a Retry-After header into seconds. Supports delay seconds and HTTP dates.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def backoff_time(attempt:int, base:float=BACKOFF_BASE, cap:float=BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with full jitter. Spreads retries out so throttled threads don't retry at the same moment.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RateLimiter:
+    def __init__(self, rate:float=10.0,
+                 burst:int=None,
+                 concurrency:int=4,
+                 max_concurrency:int=32,
+                 min_rate:float=0.5,
+                 max_rate:float=None,
+                 increase:float=1.0,
+                 decrease:float=0.5,
+                 cooldown:float=1.0):
+        """
+        Token bucket rate limiter with AIMD concurrency control.
+
+        Parameters:
+
+        - rate: starting requests per second.
+        - burst: requests allowed at once after an idle period. Defaults to the starting rate.
+        - concurrency: starting number of requests allowed in flight.
+        - max_concurrency: most requests allowed in flight.
+        - min_rate: rate never drops below this.
+        - max_rate: rate never rises above this. Unlimited if None.
+        - increase: requests per second added for each second of successful requests. Concurrency grows by about one per round of requests.
+        - decrease: factor applied to the rate and concurrency when Plex throttles a request.
+        - cooldown: seconds after a decrease where further throttled responses don't decrease again.
+                    Requests already in flight when the limit drops are often throttled too.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._slow_start = True
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self.stats = {'requests': 0, 'throttled': 0, 'waited': 0.0}
+
+
+    def __repr__(self):
+        return f"RateLimiter(rate={self.rate:.2f}, concurrency={int(self.limit)}, in_flight={self._in_flight}, stats={self.stats})"
+
+
+    def _refill(self, now:float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def _try_acquire(self) -> float:
+        """Take a slot and a token. Returns 0 on success, otherwise the seconds to wait before trying again."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= int(self.limit):
+            return None
+        self._refill(now)
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self._in_flight += 1
+        self.stats['requests'] += 1
+        return 0
+
+
+    def acquire(self):
+        """
+        Block until a request can be sent.
+        """
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    break
+                # None means every slot is in use. release() wakes the waiting threads.
+                self._condition.wait(wait)
+            self.stats['waited'] += time.monotonic() - start
+
+
+    async def acquire_async(self):
+        """
+        Wait until a request can be sent without blocking the event loop.
+        """
+        start = time.monotonic()
+        while True:
+            with self._condition:
+                wait = self._try_acquire()
+                if wait == 0:
+                    self.stats['waited'] += time.monotonic() - start
+                    return
+            await asyncio.sleep(0.01 if wait is None else wait)
+
+
+    def release(self, throttled:bool=False, retry_after:float=None):
+        """
+        Give back the slot taken by acquire and adjust the limits from the result.
+
+        Parameters:
+
+        - throttled: Plex answered with 429 or 503.
+        - retry_after: seconds from the Retry-After header. Every request for this credential waits this long.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.stats['throttled'] += 1
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                    self._tokens = 0
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self._slow_start = False
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self.limit = max(1.0, self.limit * self.decrease)
+                    self.burst = max(1.0, min(self.burst, self.rate))
+            elif self._slow_start:
+                # Until Plex first throttles, the limits double every round of requests to find the ceiling quickly.
+                self._raise_limits(1.0, 1.0)
+            else:
+                # Additive increase, roughly +increase requests per second for each second of successful traffic
+                # and +1 concurrency per round of requests.
+                self._raise_limits(self.increase / self.rate, 1 / self.limit)
+            self._condition.notify_all()
+
+
+    def _raise_limits(self, rate_step:float, limit_step:float):
+        self.rate += rate_step
+        if self.max_rate is not None:
+            self.rate = min(self.max_rate, self.rate)
+        self.burst = max(self.burst, self.rate)
+        self.limit = min(self.max_concurrency, self.limit + limit_step)
+
+
+    @contextmanager
+    def slot(self):
+        """
+        Context manager around one request that always reports success. Use acquire and release directly to report throttled responses.
+        """
+        self.acquire()
+        try:
+            yield self
+        except BaseException:
+            self.release()
+            raise
+        self.release()
+
+
+def get_rate_limiter(identity:str, **kwargs) -> RateLimiter:
+    """
+    Return the process-wide RateLimiter for a credential, creating it with kwargs on first use.
+
+    Every data source using the same web service account or API key shares the limiter, so the total rate stays under the account's limit.
+
+    Parameters:
+
+    - identity: web service username or API key
+    - kwargs: RateLimiter parameters, only used when the limiter is created
+    """
+    limiter = _LIMITERS.get(identity)
+    if limiter is not None:
+        return limiter
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(identity)
+        if limiter is None:
+            limiter = _LIMITERS[identity] = RateLimiter(**kwargs)
+    return limiter
+
+
+def clear_rate_limiters():
+    """
+    Forget the shared limiters. Data sources created afterwards start from their configured rate again.
+    """
+    with _LIMITERS_LOCK:
+        _LIMITERS.clear()
@@ -0,0 +1,294 @@
+# Async UX Datasource
+import time
+import asyncio
+from typing import List
+from requests.auth import HTTPBasicAuth
+from pmc_automation_tools.api.common import (
+    DataSource,
+    _legacy_ssl_context
+    )
+from pmc_automation_tools.api.retry import RetryPolicy
+from pmc_automation_tools.api.metrics import measure, current_metrics, row_count, add_traced_request, aiohttp_trace_config
+from pmc_automation_tools.api.throttle import THROTTLE_STATUSES, parse_retry_after, backoff_time
+from pmc_automation_tools.api.ux.datasource import (
+    UXDataSourceInput,
+    UXDataSourceResponse
+    )
+from pmc_automation_tools.common.exceptions import UXResponseErrorLog, CircuitOpenError, DeadlineExceededError
+from pmc_automation_tools.common.utils import json_loads
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+    _UNSENT_ERRORS = ()
+else:
+    # Errors raised before the request was sent, so a POST can be retried without Plex running it twice.
+    # aiohttp before 3.10 raises the same ServerTimeoutError for connect and read timeouts, so only connection failures are safe there.
+    _UNSENT_ERRORS = (aiohttp.ClientConnectorError,) + ((aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, 'ConnectionTimeoutError') else ())
+
+MAX_CONCURRENCY = 100
+
+
+class AsyncUXDataSource(DataSource):
+    _transport_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if aiohttp is not None else ()
+
+    def __init__(self, auth: HTTPBasicAuth | str,
+                 *args,
+                 test_db: bool = True,
+                 pcn_config_file: str = 'resources/pcn_config.json',
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 **kwargs):
+        """
+        asyncio version of UXDataSource. Requires aiohttp.
+
+        Parameters:
+
+        - auth: HTTPBasicAuth | str
+            - HTTPBasicAuth object
+            - PCN Reference key for getting the username/password in a json config file.
+
+        - test_db: bool, optional
+            - Use test or production database
+
+        - pcn_config_file: str, optional
+            - Path to JSON file containing username/password credentials for HTTPBasicAuth connections.
+
+        - max_concurrency: int, optional
+            - Maximum number of requests in flight at the same time.
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncUXDataSource requires aiohttp. Install it with "pip install aiohttp".')
+        super().__init__(*args, auth=auth, test_db=test_db, pcn_config_file=pcn_config_file, type='ux', **kwargs)
+        self.url_db = 'test.' if self._test_db else ''
+        self._base_url = f'https://{self.url_db}cloud.plex.com'
+        self._max_concurrency = max_concurrency
+        self._client_session = None
+        self._semaphore = None
+        self._in_flight = {}
+
+
+    def __repr__(self):
+        return f"AsyncUXDataSource(auth={self.__auth_key__}, test_db={self._test_db}, pcn_config_file={self._pcn_config_file}, max_concurrency={self._max_concurrency})"
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+    def _get_client_session(self) -> 'aiohttp.ClientSession':
+        # aiohttp sessions and semaphores belong to the running event loop, so they are created on first use.
+        if self._client_session is None or self._client_session.closed:
+            connector = aiohttp.TCPConnector(ssl=_legacy_ssl_context(), limit=self._max_concurrency)
+            trace_configs = [aiohttp_trace_config()] if self._metrics else None
+            self._client_session = aiohttp.ClientSession(connector=connector,
+                                                         auth=aiohttp.BasicAuth(self._auth.username, self._auth.password),
+                                                         trace_configs=trace_configs)
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._client_session
+
+
+    async def aclose(self):
+        """
+        Close the aiohttp session and any open connections.
+        """
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
+            self._semaphore = None
+        self.close()
+
+
+    async def _post(self, session:'aiohttp.ClientSession', url:str, body:bytes, policy:RetryPolicy, deadline:float=None) -> dict:
+        """
+        POST with the same retry rules as the synchronous data sources.
+
+        Retries errors up to policy.total times with exponential backoff.
+        If policy.idempotent_only is True (default) only errors raised before the request was sent are retried,
+        which are failed connections and connect timeouts. Read timeouts and dropped connections are raised right away,
+        since Plex may already have run the request. The policy's statuses are also only retried if policy.idempotent_only is False.
+        With a rate limiter, 429 and 503 responses are reported to the limiter and retried after Retry-After or a jittered backoff.
+        No retry starts after the deadline. Raises the last error once the retries are used up.
+
+        Other responses are decoded like the synchronous data source, so Plex error bodies become UXResponseErrorLog exceptions.
+        Raises aiohttp.ClientResponseError for error statuses without a JSON body.
+        """
+        headers = {'Content-Type': 'application/json'}
+        limiter = self._rate_limiter
+        metrics = current_metrics()
+        statuses = [] if policy.idempotent_only else list(policy.statuses)
+        retry_statuses = statuses + (THROTTLE_STATUSES if limiter is not None else [])
+        errors = 0
+        while True:
+            can_retry = errors < policy.total and (deadline is None or time.monotonic() < deadline)
+            if limiter is not None:
+                await limiter.acquire_async()
+            throttled = False
+            retry_after = None
+            trace = None if metrics is None else {}
+            try:
+                async with session.post(url, data=body, headers=headers, timeout=self._client_timeout(policy, deadline),
+                                        trace_request_ctx=trace) as response:
+                    if limiter is not None and response.status in THROTTLE_STATUSES:
+                        throttled = True
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if response.status in retry_statuses and can_retry:
+                        errors += 1
+                        wait = backoff_time(errors - 1) if throttled else policy.backoff_time(errors)
+                    elif response.status in retry_statuses:
+                        # Out of retries. The body of a throttled or failed response may not be JSON.
+                        response.raise_for_status()
+                    else:
+                        received = time.perf_counter()
+                        content = await response.read()
+                        if metrics is not None:
+                            add_traced_request(metrics, trace, len(body), len(content), response.status, time.perf_counter() - received)
+                        try:
+                            return json_loads(content)
+                        except ValueError:
+                            response.raise_for_status()
+                            raise
+                    if metrics is not None:
+                        add_traced_request(metrics, trace, len(body), 0, response.status)
+                        metrics.add(retries=1)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if not can_retry or (policy.idempotent_only and not isinstance(e, _UNSENT_ERRORS)):
+                    raise
+                errors += 1
+                wait = policy.backoff_time(errors)
+                if metrics is not None:
+                    metrics.add(retries=1)
+            finally:
+                if limiter is not None:
+                    limiter.release(throttled=throttled, retry_after=retry_after)
+            # The limiter already waits out Retry-After for every request on this account.
+            if not retry_after:
+                if deadline is not None:
+                    wait = min(wait, max(0.0, deadline - time.monotonic()))
+                await asyncio.sleep(wait)
+
+
+    async def _run_cache(self, func, *args):
+        # The sqlite backend reads and writes the disk, so it runs in an executor instead of blocking the event loop.
+        if self._cache.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+        return func(*args)
+
+
+    @staticmethod
+    def _client_timeout(policy:RetryPolicy, deadline:float=None) -> 'aiohttp.ClientTimeout':
+        connect, read = policy.timeout(deadline)
+        total = None if deadline is None else max(0.001, deadline - time.monotonic())
+        return aiohttp.ClientTimeout(total=total, sock_connect=connect, sock_read=read)
+
+
+    async def call_data_source(self, query:UXDataSourceInput, compact:bool=False, use_cache:bool=True, retry:RetryPolicy=None) -> UXDataSourceResponse:
+        """
+        Call the UX data source.
+
+        Parameters:
+
+        - query: UXDataSourceInput object
+        - compact: store the rows in a CompactRows container to reduce memory for large responses.
+        - use_cache: answer from the data source's ResponseCache when one is set. Pass False to always call Plex.
+        - retry: RetryPolicy for this call. Defaults to the data source's policy.
+
+        Returns:
+
+        - UXDataSourceResponse object
+        """
+        if not self._can_coalesce(query):
+            return await self._call_data_source(query, compact, use_cache, retry=retry)
+        # Identical calls made while this one is running await the same task.
+        key = self._request_key(query, compact)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_data_source(query, compact, use_cache, key, retry))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self._single_flight.shared += 1
+        # shield keeps the shared call running if one of the callers is cancelled.
+        return await asyncio.shield(task)
+
+
+    async def _call_data_source(self, query:UXDataSourceInput, compact:bool, use_cache:bool, key:str=None, retry:RetryPolicy=None) -> UXDataSourceResponse:
+        ttl = self._cache_ttl(query, use_cache)
+        if ttl:
+            key = key or self._request_key(query, compact)
+            response = await self._run_cache(self._cache.lookup, key)
+            if response is not None:
+                return response
+        body = query.get_request_body()
+        url = f'{self._base_url}/api/datasources/{query.__api_id__}/execute?format=2'
+        policy = retry or self._retry
+        endpoint = self._endpoint(query)
+        breaker = policy.circuit_breaker(endpoint)
+        trial = breaker.before_call() if breaker is not None else False
+        # The deadline starts before waiting on the semaphore, matching the time the caller waits.
+        deadline = None if policy.deadline is None else time.monotonic() + policy.deadline
+        session = self._get_client_session()
+        try:
+            async with self._semaphore:
+                with measure(self._metrics, self.__datasource_type__, query.__api_id__, endpoint) as metrics:
+                    try:
+                        json_data = await self._post(session, url, body, policy, deadline)
+                    except self._transport_errors as e:
+                        if breaker is not None:
+                            breaker.record_failure()
+                        if deadline is not None and time.monotonic() >= deadline:
+                            raise DeadlineExceededError(f'{endpoint} did not finish within {policy.deadline} seconds.',
+                                                        endpoint=endpoint, deadline=policy.deadline) from e
+                        raise
+                    if breaker is not None:
+                        breaker.record_success()
+                    response = UXDataSourceResponse(query.__api_id__, **json_data)
+                    if compact:
+                        response.compact()
+                    if metrics is not None:
+                        metrics.rows = row_count(response)
+        finally:
+            # A cancelled trial call doesn't record a result, so let the next call try.
+            if breaker is not None:
+                breaker.end_call(trial)
+        if ttl:
+            await self._run_cache(self._cache.store, key, response, ttl, query.__api_id__)
+        return response
+
+
+    def call_data_source_threaded(self, *args, **kwargs):
+        raise TypeError('AsyncUXDataSource calls are coroutines and can\'t run on a thread pool. Use "await call_many(query_list)" instead.')
+
+
+    def call_data_source_as_completed(self, *args, **kwargs):
+        raise TypeError('AsyncUXDataSource calls are coroutines and can\'t run on a thread pool. Use "await call_many(query_list)" instead.')
+
+
+    async def call_many(self, query_list:List[UXDataSourceInput], compact:bool=False) -> List[UXDataSourceResponse | UXResponseErrorLog]:
+        """
+        Call the UX data source for every input concurrently.
+
+        At most max_concurrency requests are in flight at once.
+
+        Parameters:
+
+        - query_list: list of UXDataSourceInput objects
+        - compact: store the rows in CompactRows containers to reduce memory for large responses.
+
+        Returns:
+
+        - list of UXDataSourceResponse objects in the same order as the inputs.
+          UXResponseErrorLog, CircuitOpenError, DeadlineExceededError, aiohttp.ClientError, and asyncio.TimeoutError exceptions
+          are returned in place of the response for failed calls, so one failure doesn't lose the other responses.
+          Identical inputs share one request and receive the same response object if the data source was created with coalesce=True.
+        """
+        async def error_safe_call(query):
+            try:
+                return await self.call_data_source(query, compact=compact)
+            except (UXResponseErrorLog, CircuitOpenError, DeadlineExceededError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                return e
+        return await asyncio.gather(*(error_safe_call(query) for query in query_list))
@@ -1,7 +1,8 @@
 # UX Datasource
-from typing import List
-import os
+from typing import List, Iterable, Union
+import re
 import json
+import functools
 from datetime import datetime, date, timedelta, timezone
 from warnings import warn
 from requests.auth import HTTPBasicAuth
@@ -9,19 +10,156 @@ from pmc_automation_tools.api.common import (
     DataSourceInput,
     DataSourceResponse,
     DataSource,
-    CustomSslContextHTTPAdapter,
-    RETRY_COUNT,
-    BACKOFF,
-    RETRY_STATUSES
+    MAX_WORKERS
     )
+from pmc_automation_tools.api.retry import RetryPolicy
+from pmc_automation_tools.api.ux.templates import get_template_registry
 from pmc_automation_tools.common.exceptions import(
-    UXResponseErrorLog
+    UXResponseErrorLog,
+    DataSourceError
 )
-from pmc_automation_tools.common.utils import plex_date_formatter
-import requests
-from urllib3.util.retry import Retry
-from itertools import chain
+from pmc_automation_tools.api.rows import CompactRows, MISSING
+from pmc_automation_tools.common.utils import json_loads, json_dumps, _to_utc
 from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import RequestException
+
+INVALID_DATE = "Invalid Datetime Format"
+# When converting datetime objects to varchars, Plex formats dates like these.
+DATE_FORMATS = ["%m/%d/%Y %I:%M:%S %p", "%b %d %Y %I:%M%p"]
+# Converted strings remembered by a UXDateConverter before the memo is cleared.
+DATE_CACHE_SIZE = 65536
+_MONTHS = {m: i for i, m in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+_MDY_DATE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4}) (\d{1,2}):(\d{1,2}):(\d{1,2}) ([AP])M', re.IGNORECASE)
+_MON_DATE = re.compile(r'([a-z]{3}) (\d{1,2}) (\d{4}) (\d{1,2}):(\d{1,2})([AP])M', re.IGNORECASE)
+
+
+def _twelve_hour(hour:str, meridiem:str) -> int:
+    hour = int(hour)
+    if not 1 <= hour <= 12:
+        raise ValueError(hour)
+    return hour % 12 + (12 if meridiem in 'Pp' else 0)
+
+
+def _parse_mdy(datestring:str) -> Union[datetime, None]:
+    match = _MDY_DATE.fullmatch(datestring)
+    if match is None:
+        return None
+    month, day, year, hour, minute, second, meridiem = match.groups()
+    return datetime(int(year), int(month), int(day), _twelve_hour(hour, meridiem), int(minute), int(second))
+
+
+def _parse_mon(datestring:str) -> Union[datetime, None]:
+    match = _MON_DATE.fullmatch(datestring)
+    if match is None or match.group(1).lower() not in _MONTHS:
+        return None
+    month, day, year, hour, minute, meridiem = match.groups()
+    return datetime(int(year), _MONTHS[month.lower()], int(day), _twelve_hour(hour, meridiem), int(minute))
+
+
+# Parsers for the Plex formats that skip strptime. Strings they can't handle go through strptime.
+_FAST_PARSERS = {DATE_FORMATS[0]: _parse_mdy, DATE_FORMATS[1]: _parse_mon}
+
+
+class UXDateConverter:
+    def __init__(self, formats:List[str]=None, tz:str='America/New_York', cache_size:int=DATE_CACHE_SIZE):
+        """
+        Converts Plex varchar date strings to the web service format (ISO format in UTC).
+
+        Meant for converting whole response columns. The format that matched last is tried first,
+        the timezone's UTC offset is looked up once per day, and repeated strings are only parsed once.
+
+        Parameters:
+
+        - formats: strptime formats to try. Defaults to DATE_FORMATS.
+        - tz: timezone the dates are in.
+        - cache_size: number of converted strings to remember.
+        """
+        self.formats = list(formats or DATE_FORMATS)
+        self.tz = tz
+        self.cache_size = cache_size
+        self._last = 0
+        self._memo = {}
+
+
+    def __repr__(self):
+        return f"UXDateConverter(formats={self.formats}, tz={self.tz}, cache_size={self.cache_size})"
+
+
+    def parse(self, datestring:str) -> tuple:
+        """
+        Return (plex_date, datasource_date) for a date string.
+
+        plex_date is the parsed local datetime and datasource_date the web service format.
+        Strings that don't match any format return (None, INVALID_DATE).
+        """
+        parsed = self._memo.get(datestring)
+        if parsed is not None:
+            return parsed
+        # When converting datetime objects to varchars, the format is using spaces for padding rather than zeroes.
+        standardized_datestring = ' '.join(datestring.split())
+        formats = self.formats
+        last = self._last
+        parsed = (None, INVALID_DATE)
+        for i in (last, *(i for i in range(len(formats)) if i != last)):
+            fast_parser = _FAST_PARSERS.get(formats[i])
+            try:
+                plex_date = fast_parser(standardized_datestring) if fast_parser else None
+            except ValueError:
+                plex_date = None
+            if plex_date is None:
+                try:
+                    plex_date = datetime.strptime(standardized_datestring, formats[i])
+                except ValueError:
+                    continue
+            self._last = i
+            parsed = (plex_date, _to_utc(plex_date, self.tz).strftime('%Y-%m-%dT%H:%M:%SZ'))
+            break
+        memo = self._memo
+        if len(memo) >= self.cache_size:
+            memo.clear()
+        memo[datestring] = parsed
+        return parsed
+
+
+    def convert(self, datestring:str) -> Union[str, None]:
+        """
+        Return the web service format for a date string, or None if it doesn't match any format.
+        """
+        if not datestring:
+            return None
+        datasource_date = self.parse(datestring)[1]
+        return None if datasource_date == INVALID_DATE else datasource_date
+
+
+    def convert_many(self, values:Iterable, keep_invalid:bool=True) -> list:
+        """
+        Convert a column of date strings to the web service format.
+
+        Parameters:
+
+        - values: iterable of date strings. Empty strings, None, and values that aren't strings are kept as they are.
+        - keep_invalid: keep strings that don't match any format. If False, they are replaced with None.
+
+        Returns:
+
+        - list of converted values in the same order.
+        """
+        parse = self.parse
+        converted = []
+        append = converted.append
+        for value in values:
+            if not value or type(value) is not str:
+                append(value)
+                continue
+            new_value = parse(value)[1]
+            if new_value == INVALID_DATE:
+                new_value = value if keep_invalid else None
+            append(new_value)
+        return converted
+
+
+_DATE_CONVERTER = UXDateConverter()
+
 
 class UXDatetime():
     def __init__(self, datestring):
@@ -34,17 +172,8 @@ class UXDatetime():
 
 
     def _dateparse(self):
-        formats = ["%m/%d/%Y %I:%M:%S %p", "%b %d %Y %I:%M%p"]
-        # When converting datetime objects to varchars, the format is using spaces for padding rather than zeroes.
-        standardized_datestring = ' '.join(self.datestring.split())
-        for f in formats:
-            try:
-                self.plex_date = datetime.strptime(standardized_datestring, f)
-                return plex_date_formatter(self.plex_date)
-            except:
-                continue
-        self.plex_date = None
-        return "Invalid Datetime Format"
+        self.plex_date, datasource_date = _DATE_CONVERTER.parse(self.datestring)
+        return datasource_date
 
 
     def to_json(self):
@@ -58,17 +187,74 @@ class UXDatetimeEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def _ux_json_default(obj):
+    if isinstance(obj, UXDatetime):
+        return obj.to_json()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+INPUT_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+# Quick check before strptime. Matches everything strptime accepts for INPUT_DATE_FORMAT, including one digit fields and lowercase t/z.
+_INPUT_DATE = re.compile(r'\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2}\.\d{1,6}Z', re.IGNORECASE)
+
+
+def _to_int(v):
+    return None if isinstance(v, str) and not v.strip() else int(v)
+
+
+def _to_str(v):
+    return str(v or '')
+
+
+def _to_bool(b):
+    if isinstance(b, int):
+        return bool(b)
+    if isinstance(b, str):
+        try:
+            return bool(int(b)) if len(b) == 1 else b.strip().upper() == 'TRUE'
+        except ValueError:
+            pass
+    return bool(b)
+
+
+_CONVERTERS = {int: _to_int, str: _to_str, bool: _to_bool}
+
+
+def _to_type(target_type):
+    # Values already converted, like UXDatetime objects, are kept so type_reconcile can run more than once.
+    def convert(v):
+        return v if isinstance(v, target_type) else target_type(v)
+    return convert
+
+
+@functools.lru_cache(maxsize=1024)
+def _coercion_plan(input_types:tuple) -> dict:
+    """
+    Map each input name to the function converting its values to the data source's type.
+
+    input_types is a tuple of (name, type) pairs so inputs from the same template share one plan.
+    """
+    return {name: _CONVERTERS.get(target_type) or _to_type(target_type) for name, target_type in input_types}
+
+
 class UXDataSourceInput(DataSourceInput):
+    _derived_attributes = ('_query_string', '_request_body')
+
     def __init__(self, data_source_key: str, *args, template_folder: str=None, **kwargs):
         super().__init__(data_source_key, type='ux', *args, **kwargs)
+        self._request_body = None
         self.__input_types__ = {}
         self.__template_folder__ = template_folder
-        if self.__template_folder__:
-            template_query = self._query_template_import()
-            if template_query:
-                for key, value in template_query.items():
-                    setattr(self, key, value)
-        self._type_create()
+        template = get_template_registry(template_folder).get(self.__api_id__) if template_folder else None
+        if template is None or not template.inputs:
+            self._type_create()
+            return
+        # Template inputs replace matching keyword inputs. Their types are worked out once per template.
+        self.update(**template.copy_inputs())
+        if template.input_types is None:
+            template.input_types = self._infer_types(template.inputs)
+        extra = {k: v for k, v in kwargs.items() if k not in template.inputs}
+        self.__input_types__ = {**self._infer_types(extra), **template.input_types}
 
 
     def __repr__(self):
@@ -81,30 +267,44 @@ class UXDataSourceInput(DataSourceInput):
 
 
     def _query_template_import(self):
-        for file in os.listdir(self.__template_folder__):
-            if f'{self.__api_id__}.json' == file:
-                with open(os.path.join(self.__template_folder__, file), 'r', encoding='utf-8') as j:
-                    template = json.loads(j.read())
-                if 'inputs' in template.keys():
-                    return template['inputs']
-                return template
+        template = get_template_registry(self.__template_folder__).get(self.__api_id__)
+        if template is not None:
+            return template.copy_inputs()
 
 
     def _update_input_parameters(self):
         self._query_string = {k:v for k, v in vars(self).items() if not k.startswith('_')}
+        self._request_body = None
 
 
-    def _type_create(self):
-        for k, v in vars(self).items():
+    def get_request_body(self) -> bytes:
+        """
+        Return the JSON request body for the data source call.
+
+        The body is encoded once and reused until an input attribute changes.
+        """
+        if self._request_body is None:
+            self._request_body = json_dumps(self._query_string, default=_ux_json_default, as_bytes=True)
+        return self._request_body
+
+
+    def _infer_types(self, values:dict) -> dict:
+        types = {}
+        for k, v in values.items():
             if not v or k.startswith('_'):
                 continue
             value_type = type(v)
             if value_type is int and len(str(v)) == 1:
-                self.__input_types__[k] = bool
+                types[k] = bool
             elif value_type is str and self._xdate(v):
-                self.__input_types__[k] = UXDatetime
+                types[k] = UXDatetime
             else:
-                self.__input_types__[k] = value_type
+                types[k] = value_type
+        return types
+
+
+    def _type_create(self):
+        self.__input_types__.update(self._infer_types(vars(self)))
 
 
     def get_type(self, attribute):
@@ -124,23 +324,18 @@ class UXDataSourceInput(DataSourceInput):
         return getattr(self, '__input_types__').get(attribute, None)
 
     def _xstr(self, s):
-        return str(s or '')
+        return _to_str(s)
 
 
     def _xbool(self, b):
-        if isinstance(b, int):
-            return bool(b)
-        if isinstance(b, str):
-            try:
-                return bool(int(b)) if len(b) == 1 else b.strip().upper() == 'TRUE'
-            except ValueError:
-                pass
-        return bool(b)
+        return _to_bool(b)
 
 
     def _xdate(self, d):
+        if not _INPUT_DATE.fullmatch(d):
+            return False
         try:
-            datetime.strptime(d, '%Y-%m-%dT%H:%M:%S.%fZ')
+            datetime.strptime(d, INPUT_DATE_FORMAT)
             return True
         except ValueError:
             return False
@@ -149,20 +344,11 @@ class UXDataSourceInput(DataSourceInput):
     def type_reconcile(self):
         """
         Adjusts the object attribute types to match the expected types of the data source.
+
+        The converters are worked out once per set of input types and every attribute is updated at once.
         """
-        for k, v in vars(self).items():
-            if k.startswith('_') or k not in self.__input_types__.keys() or v is None:
-                continue
-            target_type = getattr(self, '__input_types__')[k]
-            if target_type is int:
-                new_val = None if isinstance(v, str) and not v.strip() else target_type(v)
-            elif target_type is str:
-                new_val = self._xstr(v)
-            elif target_type is bool:
-                new_val = self._xbool(v)
-            else:
-                new_val = target_type(v)
-            setattr(self, k, new_val)
+        plan = _coercion_plan(tuple(self.__input_types__.items()))
+        self.update(**{k: plan[k](v) for k, v in vars(self).items() if v is not None and k in plan})
 
 
     def get_to_update(self, get_instance:'UXDataSourceResponse', response_index:int=0, **kwargs):
@@ -179,10 +365,8 @@ class UXDataSourceInput(DataSourceInput):
         """
         if not getattr(get_instance,'_transformed_data',None):
             raise AttributeError('Provided UXDataSourceResponse object has no _transformed_data attribute.')
-        for k, v in get_instance._transformed_data[response_index].items():
-            if k in kwargs.keys():
-                k = kwargs.get(k)
-            setattr(self, k, v)
+        row = get_instance._transformed_data[response_index]
+        self.update(**{kwargs.get(k, k): v for k, v in row.items()})
         self.type_reconcile()
         self.purge_empty()
 
@@ -201,6 +385,8 @@ class UXDataSourceInput(DataSourceInput):
             self.pop_inputs(y)
 
 class UXDataSource(DataSource):
+    _call_errors = (UXResponseErrorLog,)
+
     def __init__(self, auth: HTTPBasicAuth | str,
                  *args,
                  test_db: bool = True,
@@ -221,78 +407,89 @@ class UXDataSource(DataSource):
         """
         super().__init__(*args, auth=auth, test_db=test_db, pcn_config_file=pcn_config_file, type='ux', **kwargs)
         self.url_db = 'test.' if self._test_db else ''
+        self._base_url = f'https://{self.url_db}cloud.plex.com'
 
 
     def __repr__(self):
         return f"UXDataSource(auth={self.__auth_key__}, test_db={self._test_db}, pcn_config_file={self._pcn_config_file})"
 
 
-    def _create_session(self):
-        session = requests.Session()
-        retry = Retry(total=RETRY_COUNT, connect=RETRY_COUNT, backoff_factor=BACKOFF, status_forcelist=RETRY_STATUSES, raise_on_status=True)
-        adapter = CustomSslContextHTTPAdapter(max_retries=retry)
-        session.mount('https://', adapter)
-        return session
-    
-    def call_data_source(self, query:UXDataSourceInput) -> 'UXDataSourceResponse':
+    def call_data_source(self, query:UXDataSourceInput, compact:bool=False, use_cache:bool=True, retry:RetryPolicy=None) -> 'UXDataSourceResponse':
         """
         Call the UX data source.
 
         Parameters:
 
         - query: UXDataSourceInput object
+        - compact: store the rows in a CompactRows container to reduce memory for large responses.
+        - use_cache: answer from the data source's ResponseCache when one is set. Pass False to always call Plex.
+        - retry: RetryPolicy for this call. Defaults to the data source's policy.
 
         Returns:
 
         - UXDataSourceResponse object
         """
-        json_query = json.loads(json.dumps(query._query_string, cls=UXDatetimeEncoder))
-        url = f'https://{self.url_db}cloud.plex.com/api/datasources/{query.__api_id__}/execute?format=2'
-        session = self._create_session()
-        response = session.post(url, json=json_query, auth=self._auth)
-        json_data = response.json()
-        return UXDataSourceResponse(query.__api_id__, **json_data)
-    
+        def fetch():
+            url = f'{self._base_url}/api/datasources/{query.__api_id__}/execute?format=2'
+            session = self._get_session()
+            response = session.post(url, data=query.get_request_body(), headers={'Content-Type': 'application/json'}, auth=self._auth)
+            json_data = json_loads(response.content)
+            response = UXDataSourceResponse(query.__api_id__, **json_data)
+            return response.compact() if compact else response
+        return self._cached_call(query, fetch, compact, use_cache=use_cache, retry=retry)
 
-    def call_data_source_threaded(self, query_list:List['UXDataSourceInput']) -> List['UXDataSourceResponse']:
-        def error_safe_call(query):
-            try:
-                return self.call_data_source(query)
-            except UXResponseErrorLog as e:
-                return e
-        with ThreadPoolExecutor(max_workers=8) as pool:
-            response_list = list(pool.map(error_safe_call, query_list))
-        return response_list
-    
 
-    def list_data_source_access(self, pcn:HTTPBasicAuth|str|list):
+    def list_data_source_access(self, pcn:HTTPBasicAuth|str|list, max_workers:int=MAX_WORKERS, retry:RetryPolicy=None):
         """
         Get a list of data sources that are enabled for a specific account or any number of accounts.
 
+        Accounts are checked concurrently. Each account's request uses its own credentials, and the data source's auth isn't changed.
+
         Parameters:
 
         - pcn: Authentication for the account(s)
+        - max_workers: number of accounts checked at the same time.
+        - retry: RetryPolicy for each account's request. Defaults to the data source's policy.
 
         Returns:
 
         - UXDataSourceResponse object
+            - rows are in the same order as the accounts. Each row has a "pcn" key with the PCN reference, or the username for HTTPBasicAuth objects.
+            - failures is a list of {'pcn': pcn, 'error': exception} dictionaries for accounts that couldn't be checked.
         """
-        url = f'https://{self.url_db}cloud.plex.com/api/datasources/search?name='
-        session = self._create_session()
+        url = f'{self._base_url}/api/datasources/search?name='
+        session = self._get_session()
+        pcn_list = pcn if isinstance(pcn, list) else [pcn]
+        # Credentials are resolved here since set_auth can prompt for them.
+        auth_list = [self.set_auth(p) for p in pcn_list]
+        query = UXDataSourceInput('search')
+
+        def fetch(auth):
+            response = session.get(url, auth=auth)
+            response.raise_for_status()
+            return json_loads(response.content)
+
+        def check_access(p, auth):
+            try:
+                access = self._guarded_call(query, lambda: fetch(auth), retry)
+            except (RequestException, ValueError, DataSourceError) as e:
+                return e
+            if not isinstance(access, list):
+                return DataSourceError('Unexpected data source access response.', response=access)
+            return access
+
         access_list = []
-        if isinstance(pcn, list):
-            pcn_list = pcn
-        else:
-            pcn_list = [pcn]
-        for pcn in pcn_list:
-            self._auth = self.set_auth(pcn)
-            response = session.get(url, auth=self._auth)
-            j = json.loads(response.text)
-            for ds in j:
-                ds['pcn'] = pcn
-            access_list.append(j)
-        all_datasources = list(chain.from_iterable(access_list))
-        return UXDataSourceResponse('access_list', rows=all_datasources)
+        failures = []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pcn_list)))) as pool:
+            for p, result in zip(pcn_list, pool.map(check_access, pcn_list, auth_list)):
+                if isinstance(result, Exception):
+                    failures.append({'pcn': p, 'error': result})
+                    continue
+                label = getattr(p, 'username', p)
+                for ds in result:
+                    ds['pcn'] = label
+                access_list.extend(result)
+        return UXDataSourceResponse('access_list', rows=access_list, failures=failures)
 
 class UXDataSourceResponse(DataSourceResponse):
     def __init__(self, data_source_key, **kwargs):
@@ -314,4 +511,38 @@ class UXDataSourceResponse(DataSourceResponse):
     
     def _format_response(self):
         self._transformed_data = getattr(self, 'rows', [])
-        return self._transformed_data
\ No newline at end of file
+        return self._transformed_data
+
+
+    def convert_dates(self, *columns:str, converter:UXDateConverter=None, keep_invalid:bool=True):
+        """
+        Convert Plex varchar date columns to the web service format (ISO format in UTC) in place.
+
+        Parameters:
+
+        - columns: names of the columns to convert.
+        - converter: UXDateConverter to use, such as one for a different timezone. Defaults to America/New_York.
+        - keep_invalid: keep values that don't match a date format. If False, they are replaced with None.
+
+        Returns:
+
+        - self, for chaining
+        """
+        converter = converter or _DATE_CONVERTER
+        data = getattr(self, '_transformed_data', None)
+        if not data:
+            return self
+        if isinstance(data, CompactRows):
+            for name in columns:
+                if name in data.columns:
+                    # Missing values aren't strings, so convert_many keeps them.
+                    data.set_column(name, converter.convert_many(data.column(name, MISSING), keep_invalid))
+            return self
+        for name in columns:
+            converted = converter.convert_many((row.get(name, MISSING) for row in data), keep_invalid)
+            for row, value in zip(data, converted):
+                if value is not MISSING:
+                    row[name] = value
+        # The row dictionaries were changed in place, so rebuild any indexes on the next lookup.
+        self._index_source = None
+        return self
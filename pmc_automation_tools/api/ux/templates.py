@@ -0,0 +1,165 @@
+"""
+Cached UX data source templates.
+
+A TemplateRegistry indexes the JSON templates in a folder by data source id and keeps each parsed template in memory.
+The folder and template files are checked for changes when a template is requested, so edited templates are picked up without restarting.
+"""
+import os
+import copy
+import errno
+import json
+import threading
+from typing import Union
+
+_REGISTRIES = {}
+_REGISTRIES_LOCK = threading.Lock()
+
+
+class DataSourceTemplate:
+    """
+    One parsed data source template.
+
+    inputs holds the template's input values. input_types is filled in by UXDataSourceInput the first time the template is used.
+    """
+    def __init__(self, data_source_key:str, path:str, template:dict):
+        self.data_source_key = data_source_key
+        self.path = path
+        self.template = template
+        inputs = template['inputs'] if 'inputs' in template.keys() else template
+        self.inputs = inputs if isinstance(inputs, dict) else {}
+        self.input_types = None
+        # Mutable values are copied for each input so inputs don't share them.
+        self._mutable = {k for k, v in self.inputs.items() if isinstance(v, (list, dict))}
+
+
+    def __repr__(self):
+        return f"DataSourceTemplate(data_source_key={self.data_source_key}, path={self.path}, inputs={len(self.inputs)})"
+
+
+    def copy_inputs(self) -> dict:
+        """Return the template inputs for a new data source input."""
+        if not self._mutable:
+            return dict(self.inputs)
+        return {k: copy.deepcopy(v) if k in self._mutable else v for k, v in self.inputs.items()}
+
+
+class TemplateRegistry:
+    def __init__(self, folder:str):
+        """
+        Index of the data source templates in a folder.
+
+        Templates are named after the data source id. EX: 2360.json
+
+        Parameters:
+
+        - folder: folder containing the JSON template files.
+        """
+        self.folder = os.path.abspath(folder)
+        self._index = {}
+        self._folder_signature = None
+        self._scanned = False
+        self._templates = {}
+        self._lock = threading.Lock()
+
+
+    def __repr__(self):
+        return f"TemplateRegistry(folder={self.folder}, templates={len(self._index)})"
+
+
+    @staticmethod
+    def _signature(path:str) -> Union[tuple, None]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+    def _scan(self):
+        # Adding, removing, or renaming a file changes the folder's modified time.
+        signature = self._signature(self.folder)
+        if signature == self._folder_signature and self._scanned:
+            return
+        with self._lock:
+            if signature == self._folder_signature and self._scanned:
+                return
+            if signature is None and not self._scanned:
+                # A wrong template_folder should fail like it did when the folder was listed for every input.
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), self.folder)
+            index = {}
+            if signature is not None:
+                for entry in os.scandir(self.folder):
+                    if entry.name.endswith('.json') and entry.is_file():
+                        index[entry.name[:-5]] = entry.path
+            # A folder removed after the first scan just has no templates.
+            self._index = index
+            self._templates = {k: v for k, v in self._templates.items() if k in index}
+            self._folder_signature = signature
+            self._scanned = True
+
+
+    def get(self, data_source_key) -> Union[DataSourceTemplate, None]:
+        """
+        Return the template for a data source id, or None if the folder has no template for it.
+
+        Raises FileNotFoundError if the folder doesn't exist the first time it is read.
+
+        The template is parsed again if its file changed since it was last read.
+        """
+        self._scan()
+        key = str(data_source_key)
+        path = self._index.get(key)
+        if path is None:
+            return None
+        signature = self._signature(path)
+        cached = self._templates.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        if signature is None:
+            return None
+        with self._lock:
+            cached = self._templates.get(key)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            with open(path, 'r', encoding='utf-8') as j:
+                template = DataSourceTemplate(key, path, json.loads(j.read()))
+            self._templates[key] = (signature, template)
+        return template
+
+
+    def keys(self) -> list:
+        """Data source ids with a template in the folder."""
+        self._scan()
+        return list(self._index.keys())
+
+
+    def clear(self):
+        """Forget the parsed templates. They are read again on the next request."""
+        with self._lock:
+            self._index = {}
+            self._templates = {}
+            self._folder_signature = None
+            self._scanned = False
+
+
+def get_template_registry(folder:str) -> TemplateRegistry:
+    """
+    Return the process-wide TemplateRegistry for a folder, creating it on first use.
+    """
+    key = os.path.abspath(folder)
+    registry = _REGISTRIES.get(key)
+    if registry is not None:
+        return registry
+    with _REGISTRIES_LOCK:
+        registry = _REGISTRIES.get(key)
+        if registry is None:
+            registry = _REGISTRIES[key] = TemplateRegistry(key)
+    return registry
+
+
+def clear_template_registries():
+    """
+    Forget every template registry.
+    """
+    with _REGISTRIES_LOCK:
+        _REGISTRIES.clear()
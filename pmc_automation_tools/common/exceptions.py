@@ -46,6 +46,10 @@ class PlexResponseError(PlexApiError):...
 class DataSourceError(PlexApiError):...
 class ApiError(DataSourceError):...
 class ClassicConnectionError(DataSourceError):...
+class CircuitOpenError(DataSourceError):
+    """Thrown instead of calling an endpoint which has failed too many times in a row."""
+class DeadlineExceededError(DataSourceError):
+    """Thrown when a call and its retries take longer than the RetryPolicy deadline."""
 
 class UXResponseError(PlexResponseError):
     def __init__(self, error_dict, **kwargs):
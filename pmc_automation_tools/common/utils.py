@@ -4,13 +4,28 @@ import os
 import sys
 import json
 import csv
+import pickle
+import tempfile
+import functools
+from collections.abc import Sequence
 from warnings import warn
 import logging
 from logging.handlers import MemoryHandler
 
-from typing import Union, Generator, List, Dict, Any
+from typing import Union, Generator, List, Dict, Any, Callable, Iterable
 from openpyxl import load_workbook
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+JSON_BACKEND = 'orjson' if orjson else 'ujson' if ujson else 'json'
+
 DEFAULT_FORMATTER = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 STDOUT_FORMATTER = "[%(asctime)s][%(filename)s:%(lineno)s][%(funcName)20s()] %(message)s"
 LOG_FORMATS = {
@@ -287,6 +302,34 @@ def save_updated(in_file:str, obj:Union[dict, list], overwrite:bool=False) -> No
         raise TypeError('File name provided is not an expected type of json or csv.')
     
 
+@functools.lru_cache(maxsize=None)
+def _timezone(tz:str):
+    return pytz.timezone(tz)
+
+
+@functools.lru_cache(maxsize=4096)
+def _day_utc_offset(tz:str, day:date) -> Union[timedelta, None]:
+    """
+    UTC offset of the timezone for a whole day. None if the offset changes during the day, such as a daylight saving switch.
+    """
+    _tz = _timezone(tz)
+    start = _tz.localize(datetime.combine(day, datetime.min.time())).utcoffset()
+    end = _tz.localize(datetime.combine(day, datetime.max.time())).utcoffset()
+    return start if start == end else None
+
+
+def _to_utc(_date:datetime, tz:str) -> datetime:
+    """
+    Convert a naive local datetime in the timezone to UTC.
+
+    The offset is looked up once per day. Days with a daylight saving switch are localized by pytz.
+    """
+    offset = None if _date.tzinfo is not None else _day_utc_offset(tz, _date.date())
+    if offset is None:
+        return _timezone(tz).localize(_date).astimezone(timezone.utc)
+    return (_date - offset).replace(tzinfo=timezone.utc)
+
+
 def plex_date_formatter(*args: datetime|int, date_offset:int=0, tz_convert:bool=True, tz:str="America/New_York") -> str:
     """
     Takes 'normal' date formats and converts them to a Plex web service format (ISO format)
@@ -305,13 +348,144 @@ def plex_date_formatter(*args: datetime|int, date_offset:int=0, tz_convert:bool=
     else:
         _date = datetime(*args)
     if tz_convert:
-        _tz = pytz.timezone(tz)
-        _date = _tz.localize(_date).astimezone(timezone.utc)
+        _date = _to_utc(_date, tz)
     _date += timedelta(days=date_offset)
     f_date = _date.strftime('%Y-%m-%dT%H:%M:%SZ')
     return f_date
 
 
+def json_loads(data:Union[str, bytes]) -> Any:
+    """
+    Decode a JSON document using the fastest installed backend.
+
+    Uses orjson or ujson when installed, otherwise the standard library.
+    """
+    if orjson:
+        return orjson.loads(data)
+    if ujson:
+        return ujson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj:Any, indent:int=None, default:Callable=None, as_bytes:bool=False) -> Union[str, bytes]:
+    """
+    Encode an object as a JSON string using the fastest installed backend.
+
+    orjson only supports an indent of 2, so other indents fall back to ujson or the standard library.
+
+    Parameters:
+
+    - obj: object to encode
+    - indent: number of spaces to indent by. Compact output if None.
+    - default: function called for objects that can't otherwise be serialized.
+    - as_bytes: return utf-8 encoded bytes instead of a string.
+    """
+    if orjson and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        encoded = orjson.dumps(obj, default=default, option=option)
+        return encoded if as_bytes else encoded.decode('utf-8')
+    if ujson:
+        encoded = ujson.dumps(obj, indent=indent or 0, default=default, ensure_ascii=False, escape_forward_slashes=False)
+    else:
+        encoded = json.dumps(obj, indent=indent, default=default)
+    return encoded.encode('utf-8') if as_bytes else encoded
+
+
+def _iter_rows(rows) -> Iterable[dict]:
+    # Accept a DataSourceResponse or any iterable of dictionaries.
+    # Lazy responses that haven't built their row list yet are streamed row by row.
+    if hasattr(rows, 'iter_rows') and '_transformed_data' not in vars(rows):
+        return rows.iter_rows()
+    return getattr(rows, '_transformed_data', rows)
+
+
+def stream_json(rows:Iterable[dict], out_file:str, ndjson:bool=False, default:Callable=str) -> int:
+    """
+    Write rows to a JSON file one at a time without building the whole document in memory.
+
+    Parameters:
+
+    - rows: DataSourceResponse object or any iterable of dictionaries, including a generator.
+    - out_file: file location to save.
+    - ndjson: write one JSON object per line instead of a JSON array.
+    - default: function used for values that can't be serialized. Defaults to str.
+
+    Returns:
+
+    - number of rows written
+    """
+    count = 0
+    rows = _iter_rows(rows)
+    # CompactRows containers hand out plain dictionaries for encoding.
+    rows = rows.iter_dicts() if hasattr(rows, 'iter_dicts') else rows
+    with open(out_file, 'w', encoding='utf-8') as f:
+        if not ndjson:
+            f.write('[')
+        for row in rows:
+            if not ndjson:
+                f.write(',\n' if count else '\n')
+            f.write(json_dumps(row if isinstance(row, dict) else dict(row), default=default))
+            if ndjson:
+                f.write('\n')
+            count += 1
+        if not ndjson:
+            f.write('\n]' if count else ']')
+    return count
+
+
+def stream_csv(rows:Iterable[dict], out_file:str) -> int:
+    """
+    Write rows to a CSV file using every key found in any row as the header.
+
+    Lists and responses are read twice, once for the header and once to write.
+    Other iterables, such as generators, are spooled to a temporary file while the header is collected,
+    so only one row is held in memory at a time.
+
+    Parameters:
+
+    - rows: DataSourceResponse object or any iterable of dictionaries, including a generator.
+    - out_file: file location to save.
+
+    Returns:
+
+    - number of rows written
+    """
+    rows = _iter_rows(rows)
+    fieldnames = {}
+    spool = None
+    if isinstance(rows, Sequence):
+        for row in rows:
+            fieldnames.update(dict.fromkeys(row.keys()))
+        source = rows
+    else:
+        spool = tempfile.TemporaryFile()
+        for row in rows:
+            fieldnames.update(dict.fromkeys(row.keys()))
+            pickle.dump(row, spool, protocol=pickle.HIGHEST_PROTOCOL)
+        spool.seek(0)
+        source = _read_spool(spool)
+    count = 0
+    try:
+        with open(out_file, 'w+', encoding='utf-8') as f:
+            c = csv.DictWriter(f, fieldnames=list(fieldnames), lineterminator='\n')
+            c.writeheader()
+            for row in source:
+                c.writerow(row)
+                count += 1
+    finally:
+        if spool is not None:
+            spool.close()
+    return count
+
+
+def _read_spool(spool) -> Generator[dict, None, None]:
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+
 def chunk_list(lst:list, chunk_size:int) -> Generator[list, None, None]:
     for i in range(0, len(lst), chunk_size):
         yield lst[i:i + chunk_size]
\ No newline at end of file